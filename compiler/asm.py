@@ -0,0 +1,189 @@
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class Instruction(NamedTuple):
+    dst: str
+    op: str
+    args: List[str]
+
+
+class Program(NamedTuple):
+    name: str
+    # memory index -> site name, as printed by compiler.py
+    memories: List[str]
+    instructions: List[Instruction]
+
+    def site(self, name: str) -> int:
+        return self.memories.index(name)
+
+    @property
+    def stride(self) -> int:
+        return len(self.memories)
+
+
+# addr gen access types, see assembly.txt
+ACCESS_LOOP = 0
+ACCESS_STRIDED = 1
+ACCESS_INDEXED = 2
+# largest count of one addr gen descriptor, count[19:0]
+MAX_COUNT = 2 ** 20 - 1
+# sites of indexed loops, mem[index + mem[base]]
+INDEXED_PREFIXES = ('CI_', 'VI_', 'II_')
+
+
+def parse_inst(line: str) -> Instruction:
+    lhs, rhs = line.split('=')
+    lhs = lhs.strip()
+    op, arglist = rhs.split('(')
+    op = op.strip()
+    args = [s.strip() for s in arglist.strip()[:-1].split(',')]
+    return Instruction(lhs, op, [arg for arg in args if arg != ''])
+
+
+def parse_asm(path: str) -> Program:
+    name = os.path.basename(path).split('.')[0]
+    memories: List[str] = []
+    instructions: List[Instruction] = []
+    section = None
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line == '':
+                continue
+            if line == 'Memories:':
+                section = 'memories'
+            elif line == 'Instructions:':
+                section = 'instructions'
+            elif line.startswith('Total memories:'):
+                count = int(line.split(':')[1].strip())
+                assert(count == len(memories))
+                section = None
+            elif section == 'memories':
+                index, site = line.split(':')
+                assert(int(index) == len(memories))
+                memories.append(site.strip())
+            elif section == 'instructions':
+                instructions.append(parse_inst(line))
+    return Program(name, memories, instructions)
+
+
+def mem_index(arg: str) -> Optional[int]:
+    # mem[3] -> 3
+    if arg.startswith("mem["):
+        return int(arg[4:-1])
+    return None
+
+
+def indexed_sites(program: Program) -> List[str]:
+    return [site for site in program.memories if site.startswith(INDEXED_PREFIXES)]
+
+
+def op_type(op: str) -> Optional[str]:
+    # add_f -> f, gt_i_imm -> i, mux -> None
+    for suffix in ('_f', '_x', '_i'):
+        if op.endswith(suffix) or op.endswith(suffix + '_imm'):
+            return suffix[1:]
+    return None
+
+
+def is_compare(op: str) -> bool:
+    return op.split('_')[0] in ('gt', 'ge', 'le')
+
+
+def literal_value(site: str) -> Optional[Tuple[str, float]]:
+    # literals lifted to memory by the optimizer, e.g. C_f_0_04 or C_i_65536,
+    # not consts that happen to share the prefix, e.g. C_i_offset
+    try:
+        if site.startswith('C_f_'):
+            return 'f', float(site[4:].replace('_', '.'))
+        elif site.startswith('C_i_'):
+            return 'i', int(site[4:])
+    except ValueError:
+        pass
+    return None
+
+
+def site_types(program: Program) -> Dict[str, str]:
+    # infer f(loat)/x(fixed)/i(nteger) for every memory site
+    # from the instructions reading and writing it
+    candidates: Dict[str, set] = {site: set() for site in program.memories}
+    regs: Dict[str, Optional[str]] = {}
+
+    def operand_type(arg: str) -> Optional[str]:
+        index = mem_index(arg)
+        if index is not None:
+            site = program.memories[index]
+            lit = literal_value(site)
+            if lit is not None:
+                return lit[0]
+            known = candidates[site] - {'i'}
+            if len(known) > 0:
+                return next(iter(known))
+            return None
+        return regs.get(arg)
+
+    def hint(arg: str, ty: Optional[str]):
+        index = mem_index(arg)
+        if index is not None and ty is not None:
+            candidates[program.memories[index]].add(ty)
+
+    # two passes so that sites written late still propagate into earlier reads
+    for _ in range(2):
+        regs.clear()
+        for inst in program.instructions:
+            ty = op_type(inst.op)
+            if inst.op == 'mux':
+                hint(inst.args[0], 'i')
+                result = operand_type(inst.args[1]) or operand_type(inst.args[2])
+                for arg in inst.args[1:]:
+                    hint(arg, result)
+            elif inst.op in ('move', 'fire'):
+                result = operand_type(inst.args[0])
+            elif inst.op in ('lu_imm', 'ls_imm'):
+                result = None
+            elif inst.op.startswith('pois'):
+                for arg in inst.args:
+                    hint(arg, 'i')
+                result = 'i'
+            else:
+                for arg in inst.args:
+                    hint(arg, ty)
+                result = 'i' if is_compare(inst.op) else ty
+
+            if inst.op == 'fire':
+                result = 'i'
+            if inst.dst.startswith('r'):
+                regs[inst.dst] = result
+            else:
+                hint(inst.dst, result)
+
+    types = {}
+    for site, tys in candidates.items():
+        lit = literal_value(site)
+        if lit is not None:
+            types[site] = lit[0]
+        elif 'f' in tys:
+            types[site] = 'f'
+        elif 'x' in tys:
+            types[site] = 'x'
+        else:
+            types[site] = 'i'
+    return types
+
+
+def addr_gen(access: int, stride: int, count: int, base: int, index: int = 0) -> List[int]:
+    # three dwords per descriptor, see assembly.txt
+    assert(0 <= access < 4)
+    assert(0 <= stride < 2 ** 10)
+    assert(0 <= count <= MAX_COUNT)
+    return [(access << 30) | (stride << 20) | count, base, index]
+
+
+def addr_gen_table(program: Program, count: int, base: int) -> List[int]:
+    # one loop descriptor followed by one strided descriptor per memory site,
+    # neurons are interleaved with a stride of the number of memory sites
+    table = addr_gen(ACCESS_LOOP, 0, count, base)
+    for index in range(program.stride):
+        table += addr_gen(ACCESS_STRIDED, program.stride, count, base + index)
+    return table
@@ -1,4 +1,5 @@
 import sys
+from typing import Optional
 
 opcode_map = {
     'lu_imm': 0b00_00001,
@@ -12,6 +13,7 @@ opcode_map = {
     'move': 0b01_00100,
     'fire': 0b01_00101,
     'exp_f': 0b01_00110,
+    'pois': 0b01_00111,
 
     'and_i': 0b10_00000,
     'or_i': 0b10_00001,
@@ -48,45 +50,56 @@ def name_to_index(name: str) -> int:
     assert(False)
 
 
-with open(sys.argv[1], "r") as f:
-    lines = f.readlines()
-    for line in lines:
-        if '=' not in line:
-            continue
-        lhs, rhs = line.split('=')
-        lhs = lhs.strip()
-        op, arglist = rhs.split('(')
-        op = op.strip()
-        args = [s.strip() for s in arglist.strip()[:-1].split(',')]
+def assemble(line: str) -> Optional[int]:
+    if '=' not in line:
+        return None
+    lhs, rhs = line.split('=')
+    lhs = lhs.strip()
+    op, arglist = rhs.split('(')
+    op = op.strip()
+    args = [s.strip() for s in arglist.strip()[:-1].split(',')]
+    if opcode_map[op] >> 5 == 0b00 and not args[0].lstrip('-').isdigit():
+        # type 00 ops only hold imm[18:0]; a pois_imm threshold lifted to a
+        # memory site by the optimizer is the register form pois
+        if op != 'pois_imm':
+            raise Exception(f"{op} takes an immediate, not {args[0]}")
+        op = 'pois'
 
-        src = [0, 0, 0]
-        imm0 = 0
-        for i in range(len(args)):
-            if args[i].startswith("mem[") or args[i].startswith("r"):
-                src[i] = name_to_index(args[i])
+    src = [0, 0, 0]
+    imm0 = 0
+    for i in range(len(args)):
+        if args[i].startswith("mem[") or args[i].startswith("r"):
+            src[i] = name_to_index(args[i])
+        else:
+            # literal
+            imm = int(args[i])
+            if i == 1:
+                # imm[12:0]
+                # bounds checking
+                assert(-2 ** 13 <= imm and imm <= 2 ** 13 - 1)
+                src[1] = imm >> 7
+                src[2] = (imm >> 1) & 0b111111
+                imm0 = imm & 1
+            elif i == 0:
+                # imm[18:0]
+                # bounds checking
+                assert(-2 ** 19 <= imm and imm <= 2 ** 19 - 1)
+                src[0] = imm >> 13
+                src[1] = (imm >> 7) & 0b111111
+                src[2] = (imm >> 1) & 0b111111
+                imm0 = imm & 1
             else:
-                # literal
-                imm = int(args[i])
-                if i == 1:
-                    # imm[12:0]
-                    # bounds checking
-                    assert(-2 ** 13 <= imm and imm <= 2 ** 13 - 1)
-                    src[1] = imm >> 7
-                    src[2] = (imm >> 1) & 0b111111
-                    imm0 = imm & 1
-                elif i == 0:
-                    # imm[18:0]
-                    # bounds checking
-                    assert(-2 ** 19 <= imm and imm <= 2 ** 19 - 1)
-                    src[0] = imm >> 13
-                    src[1] = (imm >> 7) & 0b111111
-                    src[2] = (imm >> 1) & 0b111111
-                    imm0 = imm & 1
-                else:
-                    assert False, "Unexpected imm"
-        dst = name_to_index(lhs)
-        opcode = opcode_map[op]
+                assert False, "Unexpected imm"
+    dst = name_to_index(lhs)
+    opcode = opcode_map[op]
 
-        inst = (src[0] << 26) + (src[1] << 20) + \
-            (src[2] << 14) + (imm0 << 13) + (dst << 7) + opcode
-        print(hex(inst)[2:].zfill(8))
+    return (src[0] << 26) + (src[1] << 20) + \
+        (src[2] << 14) + (imm0 << 13) + (dst << 7) + opcode
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], "r") as f:
+        for line in f.readlines():
+            inst = assemble(line)
+            if inst is not None:
+                print(hex(inst)[2:].zfill(8))
@@ -0,0 +1,319 @@
+import argparse
+import json
+import math
+import os
+import subprocess
+import tempfile
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from asm import Program, site_types
+from memimage import build, resolve_site, update
+from pipeline import OPTIMIZER, compile_function
+from poisson import new_rng
+from simulator import Kernel, fire_sites
+
+
+class Candidate(NamedTuple):
+    name: str
+    precision: str
+    # exp_f instruction or taylor<terms>, '-' if the model has no exp
+    exp: str
+    # integration substeps per time step
+    substeps: int
+    # builds the ir.Function
+    func: Callable
+
+
+class Family(NamedTuple):
+    # (params, inputs) -> fire outputs, one row per step: float64 host
+    # model with finer substeps than any candidate, so that none of them
+    # is the reference itself
+    reference: Callable[[Dict[str, float], Dict[str, np.ndarray]], np.ndarray]
+    candidates: List[Candidate]
+    # host units, applied to every site the program has
+    params: Dict[str, float]
+    # input site -> (weight, events per step) of the generated input
+    inputs: Dict[str, tuple]
+    # van rossum time constant, in steps
+    tau: float
+
+
+class Result(NamedTuple):
+    name: str
+    precision: str
+    exp: str
+    substeps: int
+    cycles: int
+    memories: int
+    spikes: int
+    error: float
+
+
+def izhikevich() -> Family:
+    from ir import ValueType
+    from izhikevich import Izhikevich
+    from izhikevich_euler import IzhikevichEuler
+
+    candidates = []
+    for precision, ty in (('float', ValueType.FLOAT), ('fixed', ValueType.FIXED)):
+        for substeps in (1, 2, 4):
+            candidates.append(Candidate(f"izhikevich_{precision}_{substeps}", precision, '-', substeps,
+                                        lambda ty=ty, substeps=substeps: Izhikevich(ty, substeps)))
+    candidates.append(Candidate("izhikevich_euler", 'float', '-', 1, IzhikevichEuler))
+    # regular spiking, dt in ms
+    params = {'a': 0.02, 'b': 0.2, 'c': -65.0, 'd': 8.0, 'v_thresh': 30.0, 'dt': 1.0,
+              'v': -65.0, 'u': -13.0}
+    return Family(izhikevich_reference, candidates, params,
+                  {'exc': (3.0, 0.5), 'inh': (3.0, 0.2)}, 5.0)
+
+
+def lif() -> Family:
+    from ir import ValueType
+    from lif import LIF
+    from lif_simplify import LIF as LIFSimplify
+    from lif_snava import LIFSNAVA
+
+    candidates = [
+        Candidate("lif_float", 'float', '-', 1, lambda: LIF(ValueType.FLOAT)),
+        Candidate("lif_fixed", 'fixed', '-', 1, lambda: LIF(ValueType.FIXED)),
+        Candidate("lif_simplify", 'float', '-', 1, LIFSimplify),
+        Candidate("lif_snava_float", 'float', '-', 1, lambda: LIFSNAVA(ValueType.FLOAT)),
+        Candidate("lif_snava_fixed", 'fixed', '-', 1, lambda: LIFSNAVA(ValueType.FIXED)),
+    ]
+    # tau_m = 20ms, tau_syn = 5ms, dt = 0.1ms, 2ms refractory
+    e_m = math.exp(-0.1 / 20.0)
+    e_syn = math.exp(-0.1 / 5.0)
+    params = {'e_m': e_m, 'v_tmp': (1 - e_m) * -65.0, 'c_e': 0.05, 'c_i': -0.05,
+              'e_e': e_syn, 'e_i': e_syn, 'v_thresh': -50.0, 'v_reset': -65.0,
+              'ref_time_m1': 19, 'v_m': -65.0}
+    return Family(lif_reference, candidates, params, {'exc': (1.0, 0.5), 'inh': (1.0, 0.1)}, 20.0)
+
+
+def hodgkin_huxley() -> Family:
+    from hodgkin_huxley import HodgkinHuxley
+
+    candidates = [Candidate("hh_exp", 'float', 'exp_f', 1, HodgkinHuxley)]
+    for terms in (3, 4, 6, 8):
+        candidates.append(Candidate(f"hh_taylor{terms}", 'float', f"taylor{terms}", 1,
+                                    lambda terms=terms: HodgkinHuxley(False, terms)))
+    # traub model, conductances in uS, capacitance 0.2nF, dt in ms,
+    # m, h and n start at their steady state at -65mV
+    params = {'g_na': 20.0, 'g_k': 6.0, 'g_l': 0.01, 'e_na': 50.0, 'e_k': -90.0,
+              'e_l': -65.0, 'e_ex': 0.0, 'e_in': -80.0, 'inv_c_m': 5.0,
+              'inv_tau_syn_E': 0.2, 'inv_tau_syn_I': 0.1, 'i_offset': 0.0,
+              'v_offset': -63.0, 'v_thresh': -20.0, 'dt': 0.01,
+              'v': -65.0, 'm': 0.0097, 'h': 0.9976, 'n': 0.0271}
+    return Family(hh_reference, candidates, params,
+                  {'exc': (0.02, 0.05), 'inh': (0.02, 0.01)}, 100.0)
+
+
+def izhikevich_reference(params: Dict[str, float], inputs: Dict[str, np.ndarray],
+                         substeps: int = 16) -> np.ndarray:
+    # models/izhikevich.py in float64
+    p = params
+    steps, size = inputs['exc'].shape
+    v = np.full(size, p['v'])
+    u = np.full(size, p['u'])
+    fire = np.zeros((steps, size), dtype=bool)
+    with np.errstate(all='ignore'):
+        for step in range(steps):
+            v = v + inputs['exc'][step] - inputs['inh'][step]
+            for _ in range(substeps):
+                v = v + p['dt'] / substeps * (0.04 * v * (v + 125.0) + 140.0 - u)
+            u = u + p['a'] * (p['b'] * v - u) * p['dt']
+            fire[step] = v >= p['v_thresh']
+            v = np.where(fire[step], p['c'], v)
+            u = np.where(fire[step], u + p['d'], u)
+    return fire
+
+
+def lif_reference(params: Dict[str, float], inputs: Dict[str, np.ndarray],
+                  substeps: int = 10) -> np.ndarray:
+    # models/lif.py in float64 with dt / substeps, the per step constants
+    # rescaled to the substep; input arrives once per step
+    p = params
+    steps, size = inputs['exc'].shape
+    e_m = p['e_m'] ** (1.0 / substeps)
+    v_tmp = p['v_tmp'] * (1.0 - e_m) / (1.0 - p['e_m'])
+    c_e, c_i = p['c_e'] / substeps, p['c_i'] / substeps
+    e_e, e_i = p['e_e'] ** (1.0 / substeps), p['e_i'] ** (1.0 / substeps)
+    ref_time = (int(p['ref_time_m1']) + 1) * substeps - 1
+    v = np.full(size, p['v_m'])
+    i_e = np.zeros(size)
+    i_i = np.zeros(size)
+    ref = np.zeros(size, dtype=np.int64)
+    fire = np.zeros((steps, size), dtype=bool)
+    for step in range(steps):
+        stall = ref > 0
+        for _ in range(substeps):
+            refract = ref > 0
+            ref -= refract
+            v = np.where(refract, v, e_m * v + v_tmp + i_e * c_e + i_i * c_i)
+            i_e = np.where(refract, i_e, i_e * e_e)
+            i_i = np.where(refract, i_i, i_i * e_i)
+            fired = v >= p['v_thresh']
+            ref = np.where(fired, ref_time, ref)
+            v = np.where(fired, p['v_reset'], v)
+            fire[step] |= fired
+        stall |= fire[step]
+        i_e = np.where(stall, i_e, i_e + inputs['exc'][step])
+        i_i = np.where(stall, i_i, i_i + inputs['inh'][step])
+    return fire
+
+
+def hh_reference(params: Dict[str, float], inputs: Dict[str, np.ndarray],
+                 substeps: int = 16) -> np.ndarray:
+    # models/hodgkin_huxley.py in float64 with the host exp and dt / substeps
+    p = params
+    steps, size = inputs['exc'].shape
+    dt = p['dt'] / substeps
+    v, m, h, n = (np.full(size, p[key]) for key in ('v', 'm', 'h', 'n'))
+    g_exc = np.zeros(size)
+    g_inh = np.zeros(size)
+    fire = np.zeros((steps, size), dtype=bool)
+    with np.errstate(all='ignore'):
+        for step in range(steps):
+            for _ in range(substeps):
+                i_na = p['g_na'] * m ** 3 * h * (v - p['e_na'])
+                i_k = p['g_k'] * n ** 4 * (v - p['e_k'])
+                i_l = p['g_l'] * (v - p['e_l'])
+                i_syn = g_exc * (v - p['e_ex']) + g_inh * (v - p['e_in'])
+                v = v + (p['i_offset'] - i_na - i_k - i_l - i_syn) * p['inv_c_m'] * dt
+                V = v - p['v_offset']
+                alpha_m = 0.32 * (13.0 - V) / (np.exp((13.0 - V) * 0.25) - 1.0)
+                beta_m = 0.28 * (V - 40.0) / (np.exp((V - 40.0) * 0.2) - 1.0)
+                alpha_n = 0.032 * (15.0 - V) / (np.exp((15.0 - V) * 0.2) - 1.0)
+                beta_n = 0.5 * np.exp((10.0 - V) / 40.0)
+                alpha_h = 0.128 * np.exp((17.0 - V) / 18.0)
+                beta_h = 4.0 / (1.0 + np.exp((40.0 - V) * 0.2))
+                m = m + (alpha_m - (alpha_m + beta_m) * m) * dt
+                h = h + (alpha_h - (alpha_h + beta_h) * h) * dt
+                n = n + (alpha_n - (alpha_n + beta_n) * n) * dt
+                g_exc = g_exc - g_exc * p['inv_tau_syn_E'] * dt
+                g_inh = g_inh - g_inh * p['inv_tau_syn_I'] * dt
+            g_exc = g_exc + inputs['exc'][step]
+            g_inh = g_inh + inputs['inh'][step]
+            fire[step] = v >= p['v_thresh']
+    return fire
+
+
+FAMILIES = {'izhikevich': izhikevich, 'lif': lif, 'hh': hodgkin_huxley}
+
+
+def generate_input(family: Family, size: int, steps: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    # weighted poisson event counts, one row per step
+    rng = np.random.default_rng(seed)
+    return {site: (weight * rng.poisson(rate, (steps, size))).astype(np.float32)
+            for site, (weight, rate) in family.inputs.items()}
+
+
+def simulate(program: Program, params: Dict[str, float],
+             inputs: Dict[str, np.ndarray]) -> np.ndarray:
+    # fire outputs, one row per step, recorded input written before each step
+    steps, size = next(iter(inputs.values())).shape
+    if fire_sites(program) != ['O_fire']:
+        # the recorded input is written before every single step
+        raise Exception(f"{program.name} does not run one step with an O_fire output")
+    types = site_types(program)
+    values = {}
+    for key, value in params.items():
+        try:
+            values[resolve_site(program, key)] = value
+        except KeyError:
+            # e.g. c_e of lif_snava which has no synaptic current
+            pass
+    state = build(program, size, values)
+    rng = new_rng(np.arange(size))
+    kernel = Kernel(program)
+    fire = np.zeros((steps, size), dtype=bool)
+    for step in range(steps):
+        for key, value in inputs.items():
+            update(state, program, key, value[step], types=types)
+        kernel.run(state, rng)
+        fire[step] = state['O_fire'] != 0
+    return fire
+
+
+def spike_timing_error(reference: np.ndarray, fire: np.ndarray, tau: float) -> float:
+    # squared van rossum distance per reference spike: both trains are
+    # filtered with exp(-t / tau), a spike shifted by d steps costs about
+    # d / tau, a missing or extra spike about 0.5
+    decay = math.exp(-1.0 / tau)
+    trace = np.zeros(reference.shape[1])
+    total = 0.0
+    for step in range(len(reference)):
+        trace = trace * decay + reference[step] - fire[step]
+        total += float(np.dot(trace, trace))
+    return total / tau / max(int(reference.sum()), 1)
+
+
+def pareto(results: List[Result]) -> List[Result]:
+    # fewest cycles for each error level, sorted by cycles
+    front = []
+    for result in sorted(results, key=lambda r: (r.cycles, r.error)):
+        if len(front) == 0 or result.error < front[-1].error:
+            front.append(result)
+    return front
+
+
+def autotune(family: Family, inputs: Dict[str, np.ndarray], workdir: str,
+             tau: Optional[float] = None, optimizer: List[str] = OPTIMIZER) -> List[Result]:
+    tau = tau or family.tau
+    reference = family.reference(family.params, inputs)
+
+    results = []
+    for candidate in family.candidates:
+        try:
+            program, _ = compile_function(candidate.func(), candidate.name, workdir,
+                                          optimizer=optimizer)
+        except subprocess.CalledProcessError:
+            # e.g. out of registers or memory sites
+            print(f"{candidate.name}: failed to compile, skipped")
+            continue
+        fire = simulate(program, family.params, inputs)
+        results.append(Result(candidate.name, candidate.precision, candidate.exp,
+                              candidate.substeps, len(program.instructions), program.stride,
+                              int(fire.sum()), spike_timing_error(reference, fire, tau)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="pareto front of cycles per neuron against spike timing error")
+    parser.add_argument("family", choices=sorted(FAMILIES))
+    parser.add_argument("--neurons", type=int, default=256)
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--input", help="recorded input, .npz with one (steps, neurons) array "
+                        "per input site, generated if missing")
+    parser.add_argument("--tau", type=float, help="van rossum time constant in steps")
+    parser.add_argument("--workdir", help="keep the compiled candidates here")
+    parser.add_argument("--json", help="write all results here")
+    args = parser.parse_args()
+
+    family = FAMILIES[args.family]()
+    if args.input is not None and os.path.exists(args.input):
+        with np.load(args.input) as f:
+            inputs = {key: f[key] for key in f.files}
+    else:
+        inputs = generate_input(family, args.neurons, args.steps, args.seed)
+        if args.input is not None:
+            # record for later runs
+            np.savez(args.input, **inputs)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='gaban_autotune_')
+    results = autotune(family, inputs, workdir, args.tau)
+    front = pareto(results)
+
+    print(f"{'candidate':<24}{'precision':>10}{'exp':>10}{'substeps':>10}"
+          f"{'cycles':>8}{'spikes':>8}{'error':>10}  pareto")
+    for result in sorted(results, key=lambda r: (r.cycles, r.error)):
+        print(f"{result.name:<24}{result.precision:>10}{result.exp:>10}{result.substeps:>10}"
+              f"{result.cycles:>8}{result.spikes:>8}{result.error:>10.4f}  "
+              f"{'*' if result in front else ''}")
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump([dict(result._asdict(), pareto=result in front) for result in results],
+                      f, indent=2)
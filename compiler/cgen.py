@@ -0,0 +1,249 @@
+import argparse
+import ctypes
+import os
+import subprocess
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from asm import Instruction, Program, indexed_sites, parse_asm, parse_inst
+from memimage import build
+from poisson import new_rng
+from simulator import (EXP_C1, EXP_C2, EXP_HI, EXP_LO, EXP_LOG2E, EXP_POLY, Kernel, fire_sites,
+                       kernel_runs, steps_per_run)
+
+# op -> C expression on 32 bit words, same semantics as simulator.OPS
+C_OPS: Dict[str, str] = {
+    'lu_imm': '({0} << 13)',
+    'ls_imm': '({0})',
+    'pois_imm': '(uint32_t)(rng_next(&rng[i]) >= {0})',
+    'pois': '(uint32_t)(rng_next(&rng[i]) >= {0})',
+
+    'not_i': '(~{0})',
+    'gt_i_imm': '(uint32_t)((int32_t){0} > (int32_t){1})',
+    'sub_i_imm': '({0} - {1})',
+    'or_i_imm': '({0} | {1})',
+    'move': '({0})',
+    'fire': '({0})',
+    'exp_f': 'f2u(exp_f(u2f({0})))',
+
+    'and_i': '({0} & {1})',
+    'or_i': '({0} | {1})',
+    'sub_i': '({0} - {1})',
+    'gt_i': '(uint32_t)((int32_t){0} > (int32_t){1})',
+    'mul_f': 'f2u(u2f({0}) * u2f({1}))',
+    'add_f': 'f2u(u2f({0}) + u2f({1}))',
+    'sub_f': 'f2u(u2f({0}) - u2f({1}))',
+    'ge_f': '(uint32_t)(u2f({0}) >= u2f({1}))',
+    'div_f': 'f2u(u2f({0}) / u2f({1}))',
+    'le_f': '(uint32_t)(u2f({0}) <= u2f({1}))',
+    'mul_x': '(uint32_t)(int32_t)(((int64_t)(int32_t){0} * (int32_t){1}) >> 23)',
+    'add_x': '({0} + {1})',
+    'sub_x': '({0} - {1})',
+    'ge_x': '(uint32_t)((int32_t){0} >= (int32_t){1})',
+    'le_x': '(uint32_t)((int32_t){0} <= (int32_t){1})',
+
+    'muladd_f': 'f2u(u2f({0}) * u2f({1}) + u2f({2}))',
+    'mulsub_f': 'f2u(u2f({0}) * u2f({1}) - u2f({2}))',
+    'mux': '({0} ? {1} : {2})',
+}
+
+PRELUDE = '''#include <math.h>
+#include <stddef.h>
+#include <stdint.h>
+#include <string.h>
+
+static inline float u2f(uint32_t u) {{
+  float f;
+  memcpy(&f, &u, sizeof(f));
+  return f;
+}}
+
+static inline uint32_t f2u(float f) {{
+  uint32_t u;
+  memcpy(&u, &f, sizeof(u));
+  return u;
+}}
+
+// simulator._exp_f, no libm call so that the loop still vectorizes
+static inline float exp_f(float x) {{
+  const float xc = (x >= {lo}) & (x <= {hi}) ? x : 0.0f;
+  const float n = floorf(xc * {log2e} + 0.5f);
+  const float r = xc - n * {c1} - n * {c2};
+  float p = {p0};
+{poly}
+  float y = p * r * r + r + 1.0f;
+  const int32_t e = (int32_t)n;
+  const int32_t half = e >> 1;
+  y = y * u2f((uint32_t)(half + 127) << 23) * u2f((uint32_t)(e - half + 127) << 23);
+  y = x > {hi} ? INFINITY : y;
+  y = x < {lo} ? 0.0f : y;
+  return x != x ? x : y;
+}}
+
+// assumed model of the device random number generator, see poisson.py
+static inline uint32_t rng_next(uint32_t *s) {{
+  uint32_t x = *s;
+  x ^= x << 13;
+  x ^= x >> 17;
+  x ^= x << 5;
+  *s = x;
+  return x >> 16;
+}}
+'''.format(
+    lo=f"{EXP_LO}f", hi=f"{EXP_HI}f", log2e=f"{EXP_LOG2E}f",
+    c1=f"{EXP_C1}f", c2=f"{EXP_C2}f", p0=f"{EXP_POLY[0]}f",
+    poly="\n".join(f"  p = p * r + {c}f;" for c in EXP_POLY[1:]))
+
+
+def parse_ssa(path: str) -> List[Instruction]:
+    with open(path, 'r') as f:
+        return [parse_inst(line) for line in f if '=' in line]
+
+
+def literal(arg: str) -> str:
+    try:
+        return f"{int(arg) & 0xFFFFFFFF}u"
+    except ValueError:
+        # floating literal of an unoptimized ssa
+        bits = np.array(float(arg), dtype=np.float32).view(np.uint32)
+        return f"0x{int(bits):08x}u"
+
+
+def generate(insts: List[Instruction], program: Program) -> str:
+    # structure of arrays: mem[k] points to the words of memory site k
+    # of compiler.py's mapping, one word per neuron
+    name = program.name
+    if len(indexed_sites(program)) > 0:
+        # gathered through the index table, not one word per neuron
+        raise Exception(f"indexed sites {indexed_sites(program)} of {name} are not supported")
+    mapping = {site: index for index, site in enumerate(program.memories)}
+
+    def operand(arg: str) -> str:
+        if arg.startswith('T_'):
+            return arg
+        elif arg in mapping:
+            return f"m{mapping[arg]}[i]"
+        return literal(arg)
+
+    lines = [PRELUDE]
+    lines.append(f"void step_{name}(size_t n, uint32_t *const *mem, uint32_t *restrict rng) {{")
+    for index in range(program.stride):
+        lines.append(f"  uint32_t *restrict m{index} = mem[{index}];")
+    lines.append("#pragma GCC ivdep")
+    lines.append("  for (size_t i = 0; i < n; i++) {")
+    for inst in insts:
+        if inst.op not in C_OPS:
+            raise Exception(f"unknown op {inst.op}")
+        expr = C_OPS[inst.op].format(*[operand(arg) for arg in inst.args])
+        if inst.dst.startswith('T_'):
+            lines.append(f"    const uint32_t {inst.dst} = {expr};")
+        else:
+            lines.append(f"    m{mapping[inst.dst]}[i] = {expr};")
+    lines.append("  }")
+    lines.append("}")
+    lines.append("")
+
+    # T steps at once, counting spikes per neuron
+    sites = fire_sites(program)
+    lines.append(f"void run_{name}(size_t n, size_t steps, uint32_t *const *mem, "
+                 f"uint32_t *restrict rng, uint32_t *restrict counts) {{")
+    lines.append(f"  for (size_t t = 0; t < steps; t += {max(len(sites), 1)}) {{")
+    lines.append(f"    step_{name}(n, mem, rng);")
+    for site in sites:
+        lines.append(f"    const uint32_t *restrict fire_{mapping[site]} = mem[{mapping[site]}];")
+        lines.append("    for (size_t i = 0; i < n; i++) {")
+        lines.append(f"      counts[i] += fire_{mapping[site]}[i] != 0;")
+        lines.append("    }")
+    lines.append("  }")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+class CKernel:
+    # compiled with the local gcc, state is kept as structure of arrays
+    def __init__(self, insts: List[Instruction], program: Program, cc: str = 'gcc') -> None:
+        self.program = program
+        self.workdir = tempfile.mkdtemp(prefix='gaban_')
+        source = os.path.join(self.workdir, f"{program.name}.c")
+        library = os.path.join(self.workdir, f"{program.name}.so")
+        with open(source, 'w') as f:
+            f.write(generate(insts, program))
+        # no contraction, so that muladd_f rounds like the simulator;
+        # without trapping math the selects of exp_f are if-converted
+        subprocess.run([cc, '-O3', '-march=native', '-ffp-contract=off', '-fno-math-errno',
+                        '-fno-trapping-math', '-shared', '-fPIC', '-o', library, source, '-lm'],
+                       check=True)
+        self.lib = ctypes.CDLL(library)
+        for func in (f"step_{program.name}", f"run_{program.name}"):
+            getattr(self.lib, func).restype = None
+        self.step_func = getattr(self.lib, f"step_{program.name}")
+        self.run_func = getattr(self.lib, f"run_{program.name}")
+
+    def soa(self, state: np.ndarray) -> np.ndarray:
+        # interleaved records -> one row per memory site
+        words = state.view(np.uint32).reshape(len(state), self.program.stride)
+        return np.ascontiguousarray(words.T)
+
+    def aos(self, soa: np.ndarray, state: np.ndarray) -> None:
+        state.view(np.uint32).reshape(len(state), self.program.stride)[...] = soa.T
+
+    def pointers(self, soa: np.ndarray):
+        return (ctypes.c_void_p * len(soa))(*[row.ctypes.data for row in soa])
+
+    def run(self, soa: np.ndarray, steps: int, rng: np.ndarray) -> np.ndarray:
+        steps_per_run(self.program, steps)
+        n = soa.shape[1]
+        counts = np.zeros(n, dtype=np.uint32)
+        self.run_func(ctypes.c_size_t(n), ctypes.c_size_t(steps), self.pointers(soa),
+                      rng.ctypes.data_as(ctypes.c_void_p), counts.ctypes.data_as(ctypes.c_void_p))
+        return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="generate C from optimized ssa")
+    parser.add_argument("ssa", help="optimized ssa, e.g. lif.ssa_opt")
+    parser.add_argument("asm", help="compiler.py output with the memory mapping")
+    parser.add_argument("--run", nargs=2, type=int, metavar=('NEURONS', 'STEPS'),
+                        help="build with gcc, run and compare with the simulator")
+    parser.add_argument("params", nargs='*', help="site=value")
+    args = parser.parse_intermixed_args()
+
+    insts = parse_ssa(args.ssa)
+    program = parse_asm(args.asm)
+    if args.run is None:
+        print(generate(insts, program), end='')
+    else:
+        size, steps = args.run
+        params = {}
+        for arg in args.params:
+            key, value = arg.split('=')
+            params[key] = float(value)
+
+        state = build(program, size, params)
+        ckernel = CKernel(insts, program)
+        soa = ckernel.soa(state)
+        rng = new_rng(np.arange(size))
+        begin = time.perf_counter()
+        counts = ckernel.run(soa, steps, rng)
+        elapsed = time.perf_counter() - begin
+        print(f"C: {elapsed:.3f}s, {elapsed / size / steps * 1e9:.2f}ns per neuron step, "
+              f"mean rate: {counts.mean() / steps}")
+
+        # same run in the simulator
+        kernel = Kernel(program)
+        rng = new_rng(np.arange(size))
+        expected = np.zeros(size, dtype=np.uint32)
+        begin = time.perf_counter()
+        for outputs in kernel_runs(program, steps):
+            kernel.run(state, rng)
+            for _, site in outputs:
+                if site is not None:
+                    expected += state[site] != 0
+        elapsed = time.perf_counter() - begin
+        result = state.copy()
+        ckernel.aos(soa, result)
+        same = np.array_equal(counts, expected) and np.array_equal(result, state)
+        print(f"Simulator: {elapsed:.3f}s, matches C: {same}")
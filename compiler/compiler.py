@@ -29,41 +29,119 @@ with open(sys.argv[1], 'r') as f:
             'reg': -1
         })
 
-# liveness set
-# reverse
-live: Set[str] = set()
-for i in range(len(insts)-1, -1, -1):
-    insts[i]['live'] = live.copy()
-    # def
-    if insts[i]['lhs'] in live:
-        live.remove(insts[i]['lhs'])
-    # use
-    for arg in insts[i]['args']:
-        # only consider temp variables
-        if arg.startswith("T_"):
-            live.add(arg)
-
-# linear register allocation
-alloced_registers = set()
-reg_mapping = {}
-last_live: Set[str] = set()
-for i in range(len(insts)):
-    # TODO: spill
-    if insts[i]['lhs'].startswith('T_'):
-        for reg in range(num_registers):
-            if reg not in alloced_registers:
-                # assign lhs to reg
-                insts[i]['reg'] = reg
-                alloced_registers.add(reg)
-                reg_mapping[insts[i]['lhs']] = reg
-                break
-
-    # free regs not in live set
-    non_live = last_live - insts[i]['live']
-    for freed in non_live:
-        alloced_registers.remove(reg_mapping[freed])
-
-    last_live = insts[i]['live'].copy()
+
+def is_site(arg: str) -> bool:
+    # memory site, neither temporary nor literal
+    return not arg.startswith("T_") and not arg[0].isdigit() and not arg[0] == '-'
+
+
+def allocate(insts: list[Inst]) -> bool:
+    # liveness set
+    # reverse
+    live: Set[str] = set()
+    for i in range(len(insts)-1, -1, -1):
+        insts[i]['live'] = live.copy()
+        # def
+        if insts[i]['lhs'] in live:
+            live.remove(insts[i]['lhs'])
+        # use
+        for arg in insts[i]['args']:
+            # only consider temp variables
+            if arg.startswith("T_"):
+                live.add(arg)
+
+    # linear register allocation
+    alloced_registers = set()
+    reg_mapping.clear()
+    last_live: Set[str] = set()
+    for i in range(len(insts)):
+        insts[i]['reg'] = -1
+        if insts[i]['lhs'].startswith('T_'):
+            for reg in range(num_registers):
+                if reg not in alloced_registers:
+                    # assign lhs to reg
+                    insts[i]['reg'] = reg
+                    alloced_registers.add(reg)
+                    reg_mapping[insts[i]['lhs']] = reg
+                    break
+            if insts[i]['reg'] == -1:
+                # out of registers
+                return False
+
+        # free regs not in live set
+        non_live = last_live - insts[i]['live']
+        for freed in non_live:
+            alloced_registers.remove(reg_mapping[freed])
+
+        last_live = insts[i]['live'].copy()
+    return True
+
+
+def schedule(insts: list[Inst]) -> list[Inst]:
+    # list scheduling keeping register pressure low,
+    # independent chains such as unrolled timesteps get interleaved
+    deps: list[Set[int]] = [set() for _ in insts]
+    defs = {}
+    uses = {}
+    last_write = {}
+    reads: dict[str, list[int]] = {}
+    for i, inst in enumerate(insts):
+        for arg in inst['args']:
+            if arg.startswith("T_"):
+                deps[i].add(defs[arg])
+                uses[arg] = uses.get(arg, 0) + 1
+            elif is_site(arg):
+                # read after write
+                if arg in last_write:
+                    deps[i].add(last_write[arg])
+                reads.setdefault(arg, []).append(i)
+        lhs = inst['lhs']
+        if lhs.startswith("T_"):
+            defs[lhs] = i
+        else:
+            # write after read and write after write
+            deps[i].update(reads.get(lhs, []))
+            if lhs in last_write:
+                deps[i].add(last_write[lhs])
+            last_write[lhs] = i
+            reads[lhs] = []
+        deps[i].discard(i)
+
+    users: list[list[int]] = [[] for _ in insts]
+    for i in range(len(insts)):
+        for dep in deps[i]:
+            users[dep].append(i)
+
+    def pressure(i: int) -> int:
+        # registers freed minus registers taken
+        freed = len([arg for arg in set(insts[i]['args'])
+                     if arg.startswith("T_") and uses[arg] == insts[i]['args'].count(arg)])
+        taken = 1 if insts[i]['lhs'].startswith("T_") else 0
+        return freed - taken
+
+    waiting = [len(dep) for dep in deps]
+    ready = [i for i in range(len(insts)) if waiting[i] == 0]
+    order = []
+    while len(ready) > 0:
+        best = max(ready, key=lambda i: (pressure(i), -i))
+        ready.remove(best)
+        order.append(best)
+        for arg in insts[best]['args']:
+            if arg.startswith("T_"):
+                uses[arg] -= 1
+        for user in users[best]:
+            waiting[user] -= 1
+            if waiting[user] == 0:
+                ready.append(user)
+    assert(len(order) == len(insts))
+    return [insts[i] for i in order]
+
+
+reg_mapping: dict[str, int] = {}
+if '--schedule' in sys.argv[2:] or not allocate(insts):
+    insts = schedule(insts)
+    if not allocate(insts):
+        raise Exception(f"Out of registers, more than {num_registers} temporaries live")
 
 # allocate index for memory
 print("Memories:")
@@ -0,0 +1,216 @@
+import mmap
+import struct
+import sys
+import zlib
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+
+from asm import Instruction, Program, addr_gen_table, parse_asm
+from assembler import assemble, opcode_map
+
+# file layout, all little endian:
+# header: magic, version, number of sections, offset of section index
+# section index: one entry per section, see Section
+# sections: aligned to ALIGN bytes so that they can be DMAed and viewed in place
+MAGIC = b'GBAN'
+VERSION = 1
+ALIGN = 64
+HEADER = struct.Struct('<4sHHII')
+ENTRY = struct.Struct('<32sIIII')
+SITE = struct.Struct('<I28s')
+
+# section kinds
+KIND_INSTRUCTIONS = 1
+KIND_OFFSETS = 2
+KIND_ADDR_GEN = 3
+
+
+class Section(NamedTuple):
+    name: str
+    kind: int
+    offset: int
+    size: int
+    crc32: int
+
+
+def align(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def program_sections(program: Program) -> List[tuple]:
+    insts = [assemble(f'{inst.dst} = {inst.op}({", ".join(inst.args)})')
+             for inst in program.instructions]
+    offsets = b''.join(SITE.pack(index, site.encode())
+                       for index, site in enumerate(program.memories))
+    # relative to the population: count and base are filled by the host,
+    # base here is the site offset inside a neuron record
+    addr_gen = addr_gen_table(program, 0, 0)
+    return [
+        (program.name, KIND_INSTRUCTIONS, np.array(insts, dtype='<u4').tobytes()),
+        (program.name, KIND_OFFSETS, offsets),
+        (program.name, KIND_ADDR_GEN, np.array(addr_gen, dtype='<u4').tobytes()),
+    ]
+
+
+def pack(programs: List[Program]) -> bytes:
+    sections = []
+    for program in programs:
+        assert(len(program.name.encode()) <= 32)
+        sections += program_sections(program)
+
+    index_offset = HEADER.size
+    offset = align(index_offset + ENTRY.size * len(sections))
+    entries = []
+    for name, kind, data in sections:
+        entries.append(ENTRY.pack(name.encode(), kind, offset, len(data), zlib.crc32(data)))
+        offset = align(offset + len(data))
+
+    image = bytearray(offset)
+    image[0:HEADER.size] = HEADER.pack(MAGIC, VERSION, 0, len(sections), index_offset)
+    image[index_offset:index_offset + len(entries) * ENTRY.size] = b''.join(entries)
+    for (_name, _kind, data), entry in zip(sections, entries):
+        start = ENTRY.unpack(entry)[2]
+        image[start:start + len(data)] = data
+    return bytes(image)
+
+
+class ImageProgram:
+    def __init__(self, image: 'Image', name: str) -> None:
+        self.image = image
+        self.name = name
+
+    def raw(self, kind: int) -> memoryview:
+        section = self.image.sections[(self.name, kind)]
+        return self.image.view[section.offset:section.offset + section.size]
+
+    @property
+    def instructions(self) -> np.ndarray:
+        # zero copy, read only view into the mapped file
+        return np.frombuffer(self.raw(KIND_INSTRUCTIONS), dtype='<u4')
+
+    @property
+    def addr_gen(self) -> np.ndarray:
+        return np.frombuffer(self.raw(KIND_ADDR_GEN), dtype='<u4').reshape(-1, 3)
+
+    @property
+    def offsets(self) -> Dict[str, int]:
+        res = {}
+        for index, site in SITE.iter_unpack(self.raw(KIND_OFFSETS)):
+            res[site.rstrip(b'\0').decode()] = index
+        return res
+
+    def program(self) -> Program:
+        offsets = self.offsets
+        memories = sorted(offsets, key=lambda site: offsets[site])
+        return Program(self.name, memories,
+                       [disassemble(int(word)) for word in self.instructions])
+
+
+class Image:
+    # memory mapped program image
+    def __init__(self, path: str, verify: bool = True) -> None:
+        self.file = open(path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+        magic, version, _, count, index_offset = HEADER.unpack_from(self.view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception(f"{path} is not a program image")
+
+        self.sections: Dict[tuple, Section] = {}
+        self.names: List[str] = []
+        for i in range(count):
+            name, kind, offset, size, crc = ENTRY.unpack_from(
+                self.view, index_offset + i * ENTRY.size)
+            name = name.rstrip(b'\0').decode()
+            self.sections[(name, kind)] = Section(name, kind, offset, size, crc)
+            if name not in self.names:
+                self.names.append(name)
+
+        if verify:
+            self.verify()
+
+    def verify(self) -> None:
+        for section in self.sections.values():
+            data = self.view[section.offset:section.offset + section.size]
+            if zlib.crc32(data) != section.crc32:
+                raise Exception(f"checksum mismatch in {section.name}")
+
+    def __getitem__(self, name: str) -> ImageProgram:
+        if name not in self.names:
+            raise KeyError(f"no program {name} in image")
+        return ImageProgram(self, name)
+
+    def close(self) -> None:
+        self.view.release()
+        self.mmap.close()
+        self.file.close()
+
+    def __enter__(self) -> 'Image':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+op_map = {opcode: op for op, opcode in opcode_map.items()}
+
+
+def index_to_name(index: int) -> str:
+    if index & 0b100000:
+        return f"mem[{index & 0b11111}]"
+    return f"r{index}"
+
+
+def signed(value: int, bits: int) -> int:
+    if value & (1 << (bits - 1)):
+        return value - (1 << bits)
+    return value
+
+
+def disassemble(inst: int) -> Instruction:
+    opcode = inst & 0b1111111
+    dst = (inst >> 7) & 0b111111
+    imm0 = (inst >> 13) & 1
+    src = [(inst >> 26) & 0b111111, (inst >> 20) & 0b111111, (inst >> 14) & 0b111111]
+    op = op_map[opcode]
+    kind = opcode >> 5
+
+    if kind == 0b00:
+        # imm[18:0]
+        imm = (src[0] << 13) | (src[1] << 7) | (src[2] << 1) | imm0
+        args = [str(signed(imm, 19) if op == 'ls_imm' else imm)]
+    elif kind == 0b01 and op.endswith('_imm'):
+        # src1, imm[12:0]
+        imm = (src[1] << 7) | (src[2] << 1) | imm0
+        args = [index_to_name(src[0]), str(imm if op == 'or_i_imm' else signed(imm, 13))]
+    else:
+        args = [index_to_name(s) for s in src[:kind]]
+    return Instruction(index_to_name(dst), op, args)
+
+
+def dump(program: Program) -> str:
+    # same format as compiler.py
+    lines = ["Memories:"]
+    lines += [f"{index}: {site}" for index, site in enumerate(program.memories)]
+    lines.append(f"Total memories: {len(program.memories)}")
+    lines.append("Instructions:")
+    lines += [f"{inst.dst} = {inst.op}({', '.join(inst.args)})" for inst in program.instructions]
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    # python3 image.py pack out.img a.asm b.asm ...
+    # python3 image.py dump in.img [name ...]
+    if sys.argv[1] == 'pack':
+        programs = [parse_asm(path) for path in sys.argv[3:] if path.endswith('.asm')]
+        with open(sys.argv[2], 'wb') as f:
+            f.write(pack(programs))
+    elif sys.argv[1] == 'dump':
+        with Image(sys.argv[2]) as image:
+            for name in sys.argv[3:] or image.names:
+                print(f"# {name}")
+                print(dump(image[name].program()))
+    else:
+        raise Exception(f"unknown command {sys.argv[1]}")
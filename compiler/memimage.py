@@ -0,0 +1,142 @@
+import sys
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+from asm import Program, literal_value, parse_asm, site_types
+
+FIXED_SHIFT = 23
+SITE_PREFIXES = ['C_', 'V_', 'I_', 'O_', 'CI_', 'VI_', 'II_']
+# neurons converted at once, bounds temporaries for huge populations
+BLOCK = 1 << 20
+
+ArrayLike = Union[float, int, np.ndarray]
+Index = Union[None, int, slice, np.ndarray]
+
+
+def check_range(values: np.ndarray, words: np.ndarray, lo: int, hi: int, kind: str) -> None:
+    # words: values in the word's integer scale, NaN never fits
+    inside = (words >= lo) & (words <= hi)
+    if not np.all(inside):
+        bad = np.asarray(values)[~inside].flat[0] if np.ndim(values) > 0 else values
+        raise Exception(f"{bad} does not fit a {kind} word")
+
+
+def to_words(values: ArrayLike, ty: str) -> np.ndarray:
+    # host value -> 32 bit memory word
+    if ty == 'f':
+        return np.asarray(values, dtype=np.float32).view(np.uint32)
+    elif ty == 'x':
+        values = np.asarray(values, dtype=np.float64)
+        fixed = np.rint(values * (1 << FIXED_SHIFT))
+        check_range(values, fixed, -2 ** 31, 2 ** 31 - 1, "Q8.23 fixed point")
+        return fixed.astype(np.int64).astype(np.int32).view(np.uint32)
+    else:
+        # signed values or unsigned bit patterns
+        values = np.asarray(values)
+        check_range(values, values, -2 ** 31, 2 ** 32 - 1, "32 bit integer")
+        return values.astype(np.int64).astype(np.int32).view(np.uint32)
+
+
+def from_words(words: np.ndarray, ty: str) -> np.ndarray:
+    # 32 bit memory word -> host value
+    words = np.asarray(words, dtype=np.uint32)
+    if ty == 'f':
+        return words.view(np.float32)
+    elif ty == 'x':
+        return words.view(np.int32) / float(1 << FIXED_SHIFT)
+    else:
+        return words.view(np.int32)
+
+
+def layout_dtype(program: Program) -> np.dtype:
+    # one record per neuron, one word per memory site,
+    # record size is the stride of the addr gen descriptors
+    return np.dtype({'names': program.memories,
+                     'formats': ['<u4'] * program.stride})
+
+
+def resolve_site(program: Program, key: str) -> str:
+    # accept both `C_v_thresh` and `v_thresh`
+    if key in program.memories:
+        return key
+    for prefix in SITE_PREFIXES:
+        if prefix + key in program.memories:
+            return prefix + key
+    raise KeyError(f"no memory site {key} in {program.name}")
+
+
+def view(memory: np.ndarray, program: Program, base: int, size: int) -> np.ndarray:
+    # population records inside a larger word array, e.g. a core memory image
+    words = memory[base:base + size * program.stride]
+    return words.view(layout_dtype(program))
+
+
+def allocate(program: Program, size: int, path: Optional[str] = None) -> np.ndarray:
+    if path is None:
+        return np.zeros(size, dtype=layout_dtype(program))
+    return np.memmap(path, dtype=layout_dtype(program), mode='w+', shape=(size,))
+
+
+def open_image(program: Program, path: str, writable: bool = True) -> np.ndarray:
+    return np.memmap(path, dtype=layout_dtype(program), mode='r+' if writable else 'r')
+
+
+def update(state: np.ndarray, program: Program, key: str, values: ArrayLike,
+           index: Index = None, types: Optional[Dict[str, str]] = None) -> None:
+    # write one site in place, for all neurons or for the neurons in index
+    site = resolve_site(program, key)
+    ty = (types or site_types(program))[site]
+    field = state[site]
+    values = np.asarray(values)
+
+    if index is not None:
+        field[index] = to_words(values, ty)
+    elif values.ndim == 0:
+        field[...] = to_words(values, ty)
+    else:
+        assert(len(values) == len(field))
+        for start in range(0, len(field), BLOCK):
+            stop = min(start + BLOCK, len(field))
+            field[start:stop] = to_words(values[start:stop], ty)
+
+
+def read(state: np.ndarray, program: Program, key: str, index: Index = None,
+         types: Optional[Dict[str, str]] = None) -> np.ndarray:
+    site = resolve_site(program, key)
+    ty = (types or site_types(program))[site]
+    field = state[site] if index is None else state[site][index]
+    return from_words(field, ty)
+
+
+def build(program: Program, size: int, values: Dict[str, ArrayLike] = {},
+          path: Optional[str] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+    # values: site -> scalar or one value per neuron, in host units
+    types = site_types(program)
+    state = out if out is not None else allocate(program, size, path)
+    if out is not None:
+        # reused buffers may hold stale words
+        state[...] = 0
+    for site in program.memories:
+        lit = literal_value(site)
+        if lit is not None:
+            state[site] = to_words(lit[1], lit[0])
+    for key, value in values.items():
+        update(state, program, key, value, types=types)
+    return state
+
+
+if __name__ == '__main__':
+    # python3 memimage.py model.asm neurons out.bin [site=value|site=@values.npy ...]
+    program = parse_asm(sys.argv[1])
+    size = int(sys.argv[2])
+    values = {}
+    for arg in sys.argv[4:]:
+        key, value = arg.split('=')
+        if value.startswith('@'):
+            values[key] = np.load(value[1:], mmap_mode='r')
+        else:
+            values[key] = float(value)
+    state = build(program, size, values, path=sys.argv[3])
+    state.flush()
+    print(f"{size} neurons, {program.stride} words per neuron")
@@ -0,0 +1,260 @@
+import argparse
+import json
+import runpy
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from asm import Program
+from memimage import ArrayLike, resolve_site
+from partition import (Core, CoreState, Network, Population, Projection, build_cores,
+                       build_graph, connect, deliver, max_delay, partition, population,
+                       simulate_serial, synapses)
+from pipeline import OPTIMIZER, compile_ssa
+
+# instructions a core holds at once
+IMEM = 256
+
+
+class PopulationDecl(NamedTuple):
+    name: str
+    # ir.Function, e.g. LIF(ValueType.FLOAT)
+    model: object
+    size: int
+    # site -> scalar or one value per neuron
+    params: Dict[str, ArrayLike]
+
+
+class ProjectionDecl(NamedTuple):
+    pre: str
+    post: str
+    # connect() spec, e.g. {'connectivity': 'fixed_probability', 'p': 0.1}
+    spec: dict
+    weight: ArrayLike
+    delay: ArrayLike
+    target: str
+
+
+class Net:
+    # python3 network.py my_net.py, where my_net.py defines net:
+    #   net = Net()
+    #   net.population('exc', LIF(ValueType.FLOAT), 800, v_thresh=-50.0, ...)
+    #   net.projection('exc', 'inh', 'fixed_probability', p=0.1, weight=0.5, delay=2)
+    def __init__(self) -> None:
+        self.populations: List[PopulationDecl] = []
+        self.projections: List[ProjectionDecl] = []
+
+    def population(self, name: str, model, size: int, **params: ArrayLike) -> str:
+        if any(decl.name == name for decl in self.populations):
+            raise Exception(f"population {name} declared twice")
+        self.populations.append(PopulationDecl(name, model, size, params))
+        return name
+
+    def projection(self, pre: str, post: str, connectivity: str = 'all_to_all',
+                   weight: ArrayLike = 1.0, delay: ArrayLike = 1, target: str = 'exc',
+                   **spec) -> None:
+        spec = dict(spec, connectivity=connectivity)
+        self.projections.append(ProjectionDecl(pre, post, spec, weight, delay, target))
+
+
+def build(net: Net, workdir: str, optimizer: List[str] = OPTIMIZER) -> Network:
+    from ir import gen
+
+    # Const values live in the neuron records, so populations that only
+    # differ in them generate the same ssa and share one program
+    programs: Dict[str, Program] = {}
+    # variants of a model class are named izhikevich, izhikevich_1, ...
+    names: Set[str] = set()
+    variants: Dict[str, int] = {}
+    pops = []
+    for decl in net.populations:
+        ssa = gen(decl.model)
+        if ssa not in programs:
+            base = name = type(decl.model).__name__.lower()
+            while name in names:
+                variants[base] = variants.get(base, 0) + 1
+                name = f"{base}_{variants[base]}"
+            names.add(name)
+            programs[ssa], _ = compile_ssa(ssa, name, workdir, optimizer)
+        program = programs[ssa]
+        for key in decl.params:
+            resolve_site(program, key)
+        pops.append(Population(decl.name, program, decl.size, decl.params))
+
+    network = Network(pops, [])
+    for decl in net.projections:
+        pre_idx, post_idx = connect(decl.spec, population(network, decl.pre).size,
+                                    population(network, decl.post).size)
+        network.projections.append(Projection(decl.pre, decl.post, pre_idx, post_idx,
+                                              np.asarray(decl.weight), decl.target,
+                                              np.asarray(decl.delay)))
+    return network
+
+
+class Plan(NamedTuple):
+    core: int
+    # programs loaded once before the first step
+    preload: List[str]
+    # ops of one period of steps, step t runs steps[t % len(steps)]:
+    # ('load', program, evicted programs), ('run', program, segments)
+    # or ('deliver', delay)
+    steps: List[list]
+    # per step, in the steady state
+    switches: float
+    reloads: float
+
+
+def schedule_loads(sequence: List[str], sizes: Dict[str, int],
+                   imem: int) -> Tuple[List[str], List[Optional[List[str]]]]:
+    # instruction memory as a cache over the periodic sequence of runs,
+    # evicting the program used again farthest in the future (Belady);
+    # returns the resident programs at the start of the steady state and,
+    # for each run of the steady state, None if its program is resident
+    # or the programs evicted to load it; the steady state may span
+    # several repetitions of the sequence
+    if max(sizes.values()) > imem:
+        raise Exception(f"program of {max(sizes.values())} instructions exceeds {imem}")
+    period = len(sequence)
+
+    def next_use(name: str, pos: int) -> Tuple[int, str]:
+        for ahead in range(1, period + 1):
+            if sequence[(pos + ahead) % period] == name:
+                return ahead, name
+        return period + 1, name
+
+    def replay(resident: List[str]) -> Tuple[List[str], list]:
+        resident = list(resident)
+        loads = []
+        for pos, name in enumerate(sequence):
+            if name in resident:
+                loads.append(None)
+                continue
+            evicted = []
+            while sum(sizes[r] for r in resident) + sizes[name] > imem:
+                victim = max(resident, key=lambda r: next_use(r, pos))
+                resident.remove(victim)
+                evicted.append(victim)
+            resident.append(name)
+            loads.append(evicted)
+        return sorted(resident), loads
+
+    states: List[List[str]] = [[]]
+    while True:
+        resident, _ = replay(states[-1])
+        if resident in states:
+            break
+        states.append(resident)
+    first = states.index(resident)
+    loads = []
+    for state in states[first:]:
+        loads += replay(state)[1]
+    return states[first], loads
+
+
+def execution_plan(core: Core, network: Network, imem: int = IMEM) -> Plan:
+    # segments sharing a program run back to back, and the program order
+    # alternates between steps so the last program of a step is the first
+    # of the next one and stays loaded
+    groups: Dict[str, List[int]] = {}
+    sizes: Dict[str, int] = {}
+    for index, seg in enumerate(core.segments):
+        program = population(network, seg.population).program
+        groups.setdefault(program.name, []).append(index)
+        sizes[program.name] = len(program.instructions)
+    order = list(groups)
+    periods = [order, order[::-1]] if len(order) > 1 else [order]
+
+    sequence = [name for step in periods for name in step]
+    preload, loads = schedule_loads(sequence, sizes, imem) if len(sequence) > 0 else ([], [])
+    repeats = max(len(loads) // max(len(sequence), 1), 1)
+
+    delays = range(1, max_delay([core]) + 1) if len(core.syn_delay) > 0 else []
+    steps = []
+    pos = 0
+    for _ in range(repeats):
+        for names in periods:
+            ops: list = []
+            for name in names:
+                if loads[pos] is not None:
+                    ops.append(('load', name, loads[pos]))
+                ops.append(('run', name, groups[name]))
+                pos += 1
+            ops += [('deliver', delay) for delay in delays]
+            steps.append(ops)
+
+    switches = sum(a != b for a, b in zip(sequence, sequence[1:] + sequence[:1]))
+    reloads = sum(load is not None for load in loads)
+    return Plan(core.index, preload, steps, switches / len(periods), reloads / len(steps))
+
+
+def naive_reloads(core: Core, network: Network, imem: int = IMEM) -> Tuple[float, float]:
+    # switches and reloads per step running segments in placement order
+    sequence = [population(network, seg.population).program for seg in core.segments]
+    names = [program.name for program in sequence]
+    if len(names) == 0:
+        return 0, 0
+    sizes = {program.name: len(program.instructions) for program in sequence}
+    _, loads = schedule_loads(names, sizes, imem)
+    reloads = sum(load is not None for load in loads) / (len(loads) // len(names))
+    return sum(a != b for a, b in zip(names, names[1:] + names[:1])), reloads
+
+
+def simulate(cores: List[Core], network: Network, plans: List[Plan],
+             steps: int, seed: int = 0) -> List[np.ndarray]:
+    # partition.simulate_serial, following the execution plans
+    states = [CoreState(core, network, seed) for core in cores]
+    history: Deque[np.ndarray] = deque(maxlen=max_delay(cores))
+    spikes = []
+    for step in range(steps):
+        ops = [plan.steps[step % len(plan.steps)] for plan in plans]
+        fired = []
+        for state, core_ops in zip(states, ops):
+            segments = [index for op in core_ops if op[0] == 'run' for index in op[2]]
+            fired.append(state.core.gids[state.step(segments)])
+        all_fired = np.sort(np.concatenate(fired))
+        history.appendleft(all_fired)
+        for state, core_ops in zip(states, ops):
+            for op in core_ops:
+                if op[0] == 'deliver' and op[1] <= len(history):
+                    deliver(state.core, state.memory, history[op[1] - 1], op[1])
+        spikes.append(all_fired)
+    return spikes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="compile a network and plan its execution")
+    parser.add_argument("net", help="python file defining net = Net()")
+    parser.add_argument("--cores", type=int, default=2)
+    parser.add_argument("--chunk", type=int, default=256, help="neurons per partitioning unit")
+    parser.add_argument("--imem", type=int, default=IMEM, help="instructions per core")
+    parser.add_argument("--workdir", default="build", help="compiled programs, reused if unchanged")
+    parser.add_argument("--plan", help="write the execution plans here")
+    parser.add_argument("--steps", type=int, default=0, help="simulate and validate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    net = runpy.run_path(args.net)['net']
+    network = build(net, args.workdir)
+    programs = {pop.program.name for pop in network.populations}
+    print(f"Populations: {len(network.populations)}, programs: {len(programs)}")
+
+    syn = synapses(network)
+    graph, _ = build_graph(network, syn, args.chunk)
+    parts = partition(graph, args.cores)
+    cores = build_cores(network, syn, graph, parts, args.cores)
+    plans = [execution_plan(core, network, args.imem) for core in cores]
+    for core, plan in zip(cores, plans):
+        switches, reloads = naive_reloads(core, network, args.imem)
+        print(f"Core {core.index}: preload={plan.preload} switches={plan.switches:g} "
+              f"reloads={plan.reloads:g} per step (placement order: {switches}, {reloads})")
+
+    if args.plan:
+        with open(args.plan, 'w') as f:
+            json.dump([plan._asdict() for plan in plans], f, indent=2)
+
+    if args.steps > 0:
+        reference = simulate_serial(cores, network, args.steps, args.seed)
+        result = simulate(cores, network, plans, args.steps, args.seed)
+        same = all(np.array_equal(a, b) for a, b in zip(reference, result))
+        print(f"Spikes: {sum(len(s) for s in result)}, matches placement order: {same}")
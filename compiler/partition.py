@@ -0,0 +1,582 @@
+import argparse
+import json
+import multiprocessing
+import os
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from asm import MAX_COUNT, Program, addr_gen_table, parse_asm, site_types
+from memimage import ArrayLike, build, resolve_site, to_words, view
+from poisson import new_rng
+from simulator import Kernel, fire_sites
+
+
+class Population(NamedTuple):
+    name: str
+    program: Program
+    size: int
+    # site -> scalar or one value per neuron
+    params: Dict[str, ArrayLike]
+
+
+class Projection(NamedTuple):
+    pre: str
+    post: str
+    pre_idx: np.ndarray
+    post_idx: np.ndarray
+    weights: np.ndarray
+    # memory site accumulating the input, e.g. exc or inh
+    target: str
+    # steps until a spike arrives, scalar or one per synapse;
+    # 1 delivers at the end of the step it fired in
+    delay: ArrayLike = 1
+
+
+class Network(NamedTuple):
+    populations: List[Population]
+    projections: List[Projection]
+
+
+class Segment(NamedTuple):
+    population: str
+    start: int
+    stop: int
+    # word address of the first neuron record on the core
+    base: int
+
+
+class Core(NamedTuple):
+    index: int
+    segments: List[Segment]
+    programs: List[Program]
+    # initial memory image and addr gen descriptors
+    memory: np.ndarray
+    addr_gen: np.ndarray
+    # global neuron id of every local neuron, in segment order
+    gids: np.ndarray
+    # spike routing: local neuron -> destination cores
+    route_ptr: np.ndarray
+    route_core: np.ndarray
+    # incoming synapses grouped by global source id
+    syn_src: np.ndarray
+    syn_ptr: np.ndarray
+    syn_addr: np.ndarray
+    syn_weight: np.ndarray
+    syn_float: np.ndarray
+    syn_delay: np.ndarray
+
+
+class Graph(NamedTuple):
+    # chunk -> population index, first and last neuron
+    pop: np.ndarray
+    start: np.ndarray
+    stop: np.ndarray
+    # per step cost of every chunk
+    cycles: np.ndarray
+    memory: np.ndarray
+    # chunk -> {neighbour chunk: spike messages}
+    adjacency: List[Dict[int, int]]
+
+
+class Synapses(NamedTuple):
+    # global arrays, sorted by source
+    src: np.ndarray
+    dst: np.ndarray
+    site: np.ndarray
+    weight: np.ndarray
+    is_float: np.ndarray
+    delay: np.ndarray
+
+
+def offsets(network: Network) -> Dict[str, int]:
+    res = {}
+    total = 0
+    for pop in network.populations:
+        res[pop.name] = total
+        total += pop.size
+    return res
+
+
+def total_size(network: Network) -> int:
+    return sum(pop.size for pop in network.populations)
+
+
+def population(network: Network, name: str) -> Population:
+    for pop in network.populations:
+        if pop.name == name:
+            return pop
+    raise KeyError(f"no population {name}")
+
+
+def synapses(network: Network) -> Synapses:
+    base = offsets(network)
+    src, dst, site, weight, is_float, delay = [], [], [], [], [], []
+    for proj in network.projections:
+        post = population(network, proj.post)
+        target = resolve_site(post.program, proj.target)
+        ty = site_types(post.program)[target]
+        count = len(proj.pre_idx)
+        src.append(np.asarray(proj.pre_idx, dtype=np.int64) + base[proj.pre])
+        dst.append(np.asarray(proj.post_idx, dtype=np.int64) + base[proj.post])
+        site.append(np.full(count, post.program.site(target), dtype=np.int64))
+        weight.append(to_words(np.broadcast_to(proj.weights, count), ty))
+        is_float.append(np.full(count, ty == 'f'))
+        delay.append(np.broadcast_to(np.asarray(proj.delay, dtype=np.int64), count))
+
+    if len(src) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return Synapses(empty, empty, empty, np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=bool),
+                        empty)
+
+    src = np.concatenate(src)
+    # stable, so that every target accumulates in the same order on any partition
+    order = np.argsort(src, kind='stable')
+    delay = np.concatenate(delay)
+    assert(np.all(delay >= 1))
+    return Synapses(src[order], np.concatenate(dst)[order], np.concatenate(site)[order],
+                    np.concatenate(weight)[order], np.concatenate(is_float)[order], delay[order])
+
+
+def build_graph(network: Network, syn: Synapses, chunk: int) -> Tuple[Graph, np.ndarray]:
+    pop, start, stop, cycles, memory = [], [], [], [], []
+    chunk_of = np.zeros(total_size(network), dtype=np.int64)
+    gid = 0
+    for index, p in enumerate(network.populations):
+        for begin in range(0, p.size, chunk):
+            end = min(begin + chunk, p.size)
+            chunk_of[gid + begin:gid + end] = len(pop)
+            pop.append(index)
+            start.append(begin)
+            stop.append(end)
+            # one cycle per instruction per neuron
+            cycles.append(len(p.program.instructions) * (end - begin))
+            memory.append(p.program.stride * (end - begin))
+        gid += p.size
+
+    # incoming synapse tables are stored with their targets
+    memory = np.array(memory, dtype=np.int64)
+    np.add.at(memory, chunk_of[syn.dst], 3)
+
+    # one message per (source neuron, target chunk)
+    adjacency: List[Dict[int, int]] = [{} for _ in pop]
+    if len(syn.src) > 0:
+        nchunks = len(pop)
+        pairs = np.unique(syn.src * nchunks + chunk_of[syn.dst])
+        a = chunk_of[pairs // nchunks]
+        b = pairs % nchunks
+        edges, counts = np.unique(a * nchunks + b, return_counts=True)
+        for edge, count in zip(edges.tolist(), counts.tolist()):
+            u, v = divmod(edge, nchunks)
+            if u == v:
+                continue
+            adjacency[u][v] = adjacency[u].get(v, 0) + count
+            adjacency[v][u] = adjacency[v].get(u, 0) + count
+
+    graph = Graph(np.array(pop), np.array(start), np.array(stop),
+                  np.array(cycles, dtype=np.int64), memory, adjacency)
+    return graph, chunk_of
+
+
+def partition(graph: Graph, cores: int, imbalance: float = 0.05, capacity: int = 0, passes: int = 8) -> np.ndarray:
+    # linear deterministic greedy streaming in BFS order,
+    # followed by Fiduccia-Mattheyses style boundary refinement
+    nchunks = len(graph.pop)
+    cap_cycles = max(graph.cycles.sum() / cores * (1 + imbalance), graph.cycles.max())
+    cap_memory = max(graph.memory.sum() / cores * (1 + imbalance), graph.memory.max())
+    if capacity > 0:
+        cap_memory = min(cap_memory, capacity)
+
+    load_cycles = np.zeros(cores, dtype=np.int64)
+    load_memory = np.zeros(cores, dtype=np.int64)
+    parts = np.full(nchunks, -1, dtype=np.int64)
+
+    def connectivity(v: int) -> np.ndarray:
+        conn = np.zeros(cores)
+        for u, w in graph.adjacency[v].items():
+            if parts[u] >= 0:
+                conn[parts[u]] += w
+        return conn
+
+    def fits(v: int, p: int) -> bool:
+        return load_cycles[p] + graph.cycles[v] <= cap_cycles \
+            and load_memory[p] + graph.memory[v] <= cap_memory
+
+    # stream order: BFS from the heaviest chunks
+    order = []
+    seen = np.zeros(nchunks, dtype=bool)
+    for root in np.argsort(-graph.cycles, kind='stable'):
+        if seen[root]:
+            continue
+        seen[root] = True
+        queue = [int(root)]
+        while len(queue) > 0:
+            v = queue.pop(0)
+            order.append(v)
+            for u in sorted(graph.adjacency[v], key=lambda u: -graph.adjacency[v][u]):
+                if not seen[u]:
+                    seen[u] = True
+                    queue.append(u)
+
+    for v in order:
+        fill = np.maximum(load_cycles / cap_cycles, load_memory / cap_memory)
+        score = connectivity(v) * (1 - fill)
+        feasible = [p for p in range(cores) if fits(v, p)]
+        if len(feasible) > 0:
+            # ties go to the least loaded core
+            best = max(feasible, key=lambda p: (score[p], -fill[p]))
+        else:
+            # chunk granularity overshoots the balance, only memory is a hard limit
+            best = int(np.argmin(fill))
+            if capacity > 0 and load_memory[best] + graph.memory[v] > capacity:
+                raise Exception(f"chunk {v} does not fit into any core")
+        parts[v] = best
+        load_cycles[best] += graph.cycles[v]
+        load_memory[best] += graph.memory[v]
+
+    for _ in range(passes):
+        moved = 0
+        for v in range(nchunks):
+            if len(graph.adjacency[v]) == 0:
+                continue
+            conn = connectivity(v)
+            own = parts[v]
+            gain = conn - conn[own]
+            for p in np.argsort(-gain, kind='stable'):
+                if gain[p] <= 0:
+                    break
+                if fits(v, p):
+                    load_cycles[own] -= graph.cycles[v]
+                    load_memory[own] -= graph.memory[v]
+                    load_cycles[p] += graph.cycles[v]
+                    load_memory[p] += graph.memory[v]
+                    parts[v] = p
+                    moved += 1
+                    break
+        if moved == 0:
+            break
+
+    return parts
+
+
+def traffic(syn: Synapses, owner: np.ndarray) -> int:
+    # spike messages crossing cores if every neuron fires once
+    if len(syn.src) == 0:
+        return 0
+    cores = owner.max() + 1
+    pairs = np.unique(syn.src * cores + owner[syn.dst])
+    return int(np.count_nonzero(owner[pairs // cores] != pairs % cores))
+
+
+def build_cores(network: Network, syn: Synapses, graph: Graph, parts: np.ndarray, cores: int) -> List[Core]:
+    base = offsets(network)
+    total = total_size(network)
+    owner = np.zeros(total, dtype=np.int64)
+    record = np.zeros(total, dtype=np.int64)
+    local = np.zeros(total, dtype=np.int64)
+
+    layouts = []
+    for c in range(cores):
+        # coalesce chunks of the same population
+        segments: List[List[int]] = []
+        for v in np.flatnonzero(parts == c):
+            p, begin, end = graph.pop[v], graph.start[v], graph.stop[v]
+            if len(segments) > 0 and segments[-1][0] == p and segments[-1][2] == begin:
+                segments[-1][2] = end
+            else:
+                segments.append([p, begin, end])
+        # one addr gen descriptor counts at most MAX_COUNT neurons
+        segments = [[p, start, min(start + MAX_COUNT, end)]
+                    for p, begin, end in segments
+                    for start in range(begin, end, MAX_COUNT)]
+
+        addr = 0
+        count = 0
+        placed = []
+        for p, begin, end in segments:
+            pop = network.populations[p]
+            gids = np.arange(begin, end) + base[pop.name]
+            owner[gids] = c
+            record[gids] = addr + np.arange(end - begin) * pop.program.stride
+            local[gids] = count + np.arange(end - begin)
+            placed.append(Segment(pop.name, int(begin), int(end), int(addr)))
+            addr += (end - begin) * pop.program.stride
+            count += end - begin
+        layouts.append((placed, addr))
+
+    # (source, destination core) pairs
+    if len(syn.src) > 0:
+        pairs = np.unique(syn.src * cores + owner[syn.dst])
+        route_src = pairs // cores
+        route_dst = pairs % cores
+    else:
+        route_src = route_dst = np.zeros(0, dtype=np.int64)
+
+    result = []
+    for c, (placed, words) in enumerate(layouts):
+        memory = np.zeros(words, dtype=np.uint32)
+        addr_gen = []
+        gids = []
+        programs = []
+        for seg in placed:
+            pop = population(network, seg.population)
+            params = {}
+            for key, value in pop.params.items():
+                value = np.asarray(value)
+                params[key] = value if value.ndim == 0 else value[seg.start:seg.stop]
+            build(pop.program, seg.stop - seg.start, params,
+                  out=view(memory, pop.program, seg.base, seg.stop - seg.start))
+            addr_gen += addr_gen_table(pop.program, seg.stop - seg.start, seg.base)
+            gids.append(np.arange(seg.start, seg.stop) + base[pop.name])
+            if pop.program not in programs:
+                programs.append(pop.program)
+        gids = np.concatenate(gids) if len(gids) > 0 else np.zeros(0, dtype=np.int64)
+
+        # routing table for local sources
+        mine = owner[route_src] == c
+        route_local = local[route_src[mine]]
+        route_ptr = np.searchsorted(route_local, np.arange(len(gids) + 1))
+        route_core = route_dst[mine]
+
+        # incoming synapses, order by source is kept
+        rows = np.flatnonzero(owner[syn.dst] == c)
+        syn_src, starts = np.unique(syn.src[rows], return_index=True)
+        syn_ptr = np.append(starts, len(rows))
+
+        result.append(Core(c, placed, programs, memory,
+                           np.array(addr_gen, dtype=np.uint32), gids,
+                           route_ptr, route_core,
+                           syn_src, syn_ptr,
+                           record[syn.dst[rows]] + syn.site[rows],
+                           syn.weight[rows], syn.is_float[rows], syn.delay[rows]))
+    return result
+
+
+def max_delay(cores: List[Core]) -> int:
+    return max([int(core.syn_delay.max()) for core in cores if len(core.syn_delay) > 0] + [1])
+
+
+def deliver(core: Core, memory: np.ndarray, spikes: np.ndarray, delay: int = 1) -> None:
+    # spikes: sorted global ids of all neurons fired delay - 1 steps ago,
+    # only synapses of that delay are applied
+    pos = np.searchsorted(core.syn_src, spikes)
+    hit = pos < len(core.syn_src)
+    hit[hit] = core.syn_src[pos[hit]] == spikes[hit]
+    pos = pos[hit]
+    starts = core.syn_ptr[pos]
+    lengths = core.syn_ptr[pos + 1] - starts
+    if lengths.sum() == 0:
+        return
+    # concatenate row ranges
+    rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) \
+        + np.arange(lengths.sum())
+    rows = rows[core.syn_delay[rows] == delay]
+    floats = core.syn_float[rows]
+    np.add.at(memory.view(np.float32), core.syn_addr[rows[floats]],
+              core.syn_weight[rows[floats]].view(np.float32))
+    np.add.at(memory.view(np.int32), core.syn_addr[rows[~floats]],
+              core.syn_weight[rows[~floats]].view(np.int32))
+
+
+class CoreState:
+    def __init__(self, core: Core, network: Network, seed: int,
+                 memory: Optional[np.ndarray] = None) -> None:
+        # memory: image to run in place, e.g. mapped from a snapshot
+        self.core = core
+        self.memory = core.memory.copy() if memory is None else memory
+        for program in core.programs:
+            if len(fire_sites(program)) > 1:
+                # spikes are delivered between steps, not between runs
+                raise Exception(f"{program.name} runs {len(fire_sites(program))} steps at once, "
+                                "networks need one step per run")
+        self.kernels = {program.name: Kernel(program) for program in core.programs}
+        self.views = []
+        first = 0
+        for seg in core.segments:
+            pop = population(network, seg.population)
+            size = seg.stop - seg.start
+            state = view(self.memory, pop.program, seg.base, size)
+            rng = new_rng(core.gids[first:first + size], seed)
+            self.views.append((pop.program.name, state, rng, first))
+            first += size
+
+    def step(self, segments: Optional[List[int]] = None) -> np.ndarray:
+        # run every segment, or the given ones in that order,
+        # return local indices of fired neurons
+        fired = []
+        for index in range(len(self.views)) if segments is None else segments:
+            name, state, rng, first = self.views[index]
+            self.kernels[name].run(state, rng)
+            if 'O_fire' in state.dtype.names:
+                fired.append(np.flatnonzero(state['O_fire']) + first)
+        if len(fired) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(fired)
+
+    def routes(self, fired: np.ndarray, dst: int) -> np.ndarray:
+        ptr = self.core.route_ptr
+        lengths = ptr[fired + 1] - ptr[fired]
+        owners = np.repeat(fired, lengths)
+        rows = np.repeat(ptr[fired] - np.cumsum(lengths) + lengths, lengths) \
+            + np.arange(lengths.sum())
+        return np.sort(self.core.gids[owners[self.core.route_core[rows] == dst]])
+
+
+class Simulation:
+    # all cores in one process, stepped by the caller
+    def __init__(self, cores: List[Core], network: Network, seed: int = 0,
+                 memories: Optional[List[np.ndarray]] = None) -> None:
+        self.cores = cores
+        self.network = network
+        self.states = [CoreState(core, network, seed, None if memories is None else memories[c])
+                       for c, core in enumerate(cores)]
+        # spikes of the last steps, most recent first, for delayed synapses
+        self.history: Deque[np.ndarray] = deque(maxlen=max_delay(cores))
+        self.steps = 0
+
+    def step(self) -> np.ndarray:
+        # sorted global ids of the neurons fired in this step
+        fired = [state.step() for state in self.states]
+        all_fired = np.sort(np.concatenate(
+            [state.core.gids[f] for state, f in zip(self.states, fired)]))
+        self.history.appendleft(all_fired)
+        for state in self.states:
+            for delay, delayed in enumerate(self.history, 1):
+                deliver(state.core, state.memory, delayed, delay)
+        self.steps += 1
+        return all_fired
+
+
+def simulate_serial(cores: List[Core], network: Network, steps: int, seed: int = 0) -> List[np.ndarray]:
+    simulation = Simulation(cores, network, seed)
+    return [simulation.step() for _ in range(steps)]
+
+
+def _worker(core: Core, network: Network, steps: int, seed: int, inboxes, results) -> None:
+    state = CoreState(core, network, seed)
+    others = [c for c in range(len(inboxes)) if c != core.index]
+    pending: Dict[int, List[np.ndarray]] = {}
+    history: Deque[np.ndarray] = deque(maxlen=max_delay([core]))
+    recorded = []
+    for step in range(steps):
+        fired = state.step()
+        # send to every other core each step, even if empty, to stay in lockstep
+        for dst in others:
+            inboxes[dst].put((step, state.routes(fired, dst)))
+        received = [state.core.gids[fired]]
+        while len(pending.get(step, [])) < len(others):
+            msg_step, msg = inboxes[core.index].get()
+            pending.setdefault(msg_step, []).append(msg)
+        received += pending.pop(step, [])
+        history.appendleft(np.sort(np.concatenate(received)))
+        for delay, delayed in enumerate(history, 1):
+            deliver(state.core, state.memory, delayed, delay)
+        recorded.append(state.core.gids[fired])
+    results.put((core.index, recorded))
+
+
+def simulate(cores: List[Core], network: Network, steps: int, seed: int = 0) -> List[np.ndarray]:
+    # one process per core standing in for a board
+    inboxes = [multiprocessing.Queue() for _ in cores]
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_worker, args=(core, network, steps, seed, inboxes, results))
+               for core in cores]
+    for worker in workers:
+        worker.start()
+    recorded = dict(results.get() for _ in cores)
+    for worker in workers:
+        worker.join()
+    return [np.sort(np.concatenate([recorded[c][step] for c in range(len(cores))]))
+            for step in range(steps)]
+
+
+def save(cores: List[Core], outdir: str) -> None:
+    os.makedirs(outdir, exist_ok=True)
+    manifest = []
+    for core in cores:
+        np.savez(os.path.join(outdir, f"core{core.index}.npz"),
+                 memory=core.memory, addr_gen=core.addr_gen, gids=core.gids,
+                 route_ptr=core.route_ptr, route_core=core.route_core,
+                 syn_src=core.syn_src, syn_ptr=core.syn_ptr, syn_addr=core.syn_addr,
+                 syn_weight=core.syn_weight, syn_float=core.syn_float, syn_delay=core.syn_delay)
+        manifest.append({
+            'core': core.index,
+            'programs': [program.name for program in core.programs],
+            'segments': [seg._asdict() for seg in core.segments],
+            'memory_words': int(len(core.memory)),
+        })
+    with open(os.path.join(outdir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def connect(spec: dict, pre: int, post: int) -> Tuple[np.ndarray, np.ndarray]:
+    kind = spec.get('connectivity', 'all_to_all')
+    rng = np.random.default_rng(spec.get('seed', 0))
+    if kind == 'all_to_all':
+        flat = np.arange(pre * post)
+    elif kind == 'one_to_one':
+        assert(pre == post)
+        return np.arange(pre), np.arange(post)
+    elif kind == 'fixed_probability':
+        count = rng.binomial(pre * post, spec['p'])
+        flat = np.sort(rng.choice(pre * post, size=count, replace=False))
+    else:
+        raise Exception(f"unknown connectivity {kind}")
+    return flat // post, flat % post
+
+
+def load_network(path: str) -> Network:
+    with open(path, "r") as f:
+        spec = json.load(f)
+    root = os.path.dirname(path)
+    pops = []
+    for p in spec['populations']:
+        program = parse_asm(os.path.join(root, p['program']))
+        pops.append(Population(p['name'], program, p['size'], p.get('params', {})))
+    network = Network(pops, [])
+    for proj in spec.get('projections', []):
+        pre_idx, post_idx = connect(proj, population(network, proj['pre']).size,
+                                    population(network, proj['post']).size)
+        network.projections.append(Projection(proj['pre'], proj['post'], pre_idx, post_idx,
+                                              np.asarray(proj.get('weight', 1.0)),
+                                              proj.get('target', 'exc'), proj.get('delay', 1)))
+    return network
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="partition a network over cores or boards")
+    parser.add_argument("network", help="network description in json")
+    parser.add_argument("--cores", type=int, default=2)
+    parser.add_argument("--chunk", type=int, default=256, help="neurons per partitioning unit")
+    parser.add_argument("--imbalance", type=float, default=0.05)
+    parser.add_argument("--capacity", type=int, default=0, help="memory words per core")
+    parser.add_argument("--out", help="directory for per-core images")
+    parser.add_argument("--steps", type=int, default=0, help="simulate and validate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    network = load_network(args.network)
+    syn = synapses(network)
+    graph, chunk_of = build_graph(network, syn, args.chunk)
+    parts = partition(graph, args.cores, args.imbalance, args.capacity)
+    cores = build_cores(network, syn, graph, parts, args.cores)
+
+    owner = parts[chunk_of]
+    print(f"Chunks: {len(graph.pop)}")
+    for c in range(args.cores):
+        print(f"Core {c}: cycles={graph.cycles[parts == c].sum()} memory={graph.memory[parts == c].sum()} "
+              f"segments={[(s.population, s.start, s.stop) for s in cores[c].segments]}")
+    print(f"Cross core messages per full spike volley: {traffic(syn, owner)} "
+          f"(single core: 0, round robin: {traffic(syn, np.arange(len(owner)) % args.cores)})")
+
+    if args.out:
+        save(cores, args.out)
+
+    if args.steps > 0:
+        reference = simulate_serial(build_cores(network, syn, graph, np.zeros_like(parts), 1),
+                                    network, args.steps, args.seed)
+        result = simulate(cores, network, args.steps, args.seed)
+        total = sum(len(s) for s in result)
+        same = all(np.array_equal(a, b) for a, b in zip(reference, result))
+        print(f"Spikes: {total}, matches single core: {same}")
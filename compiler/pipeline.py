@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+from asm import Program, parse_asm
+
+COMPILER = os.path.dirname(os.path.abspath(__file__))
+MODELS = os.path.normpath(os.path.join(COMPILER, '..', 'models'))
+# same steps as the Makefile: .ssa -> .ssa_opt -> .asm
+OPTIMIZER = ['cargo', 'run', '--quiet', '--bin', 'optimizer', '--']
+
+if MODELS not in sys.path:
+    # model classes are imported as in models/*.py, next to ir.py
+    sys.path.append(MODELS)
+
+
+def compile_ssa(ssa: str, name: str, workdir: str,
+                optimizer: List[str] = OPTIMIZER) -> Tuple[Program, str]:
+    # returns the program and the path of the optimized ssa
+    os.makedirs(workdir, exist_ok=True)
+    base = os.path.join(os.path.abspath(workdir), name)
+    if os.path.exists(f"{base}.asm") and os.path.exists(f"{base}.ssa"):
+        with open(f"{base}.ssa", 'r') as f:
+            if f.read() == ssa + "\n":
+                # compiled by an earlier run
+                return parse_asm(f"{base}.asm"), f"{base}.ssa_opt"
+        os.remove(f"{base}.asm")
+    with open(f"{base}.ssa", 'w') as f:
+        f.write(ssa + "\n")
+    with open(f"{base}.ssa_opt", 'w') as f:
+        subprocess.run(optimizer + [f"{base}.ssa"], stdout=f, check=True, cwd=COMPILER)
+    with open(f"{base}.asm.tmp", 'w') as f:
+        subprocess.run([sys.executable, os.path.join(COMPILER, 'compiler.py'), f"{base}.ssa_opt"],
+                       stdout=f, check=True, cwd=COMPILER)
+    # only complete outputs count as compiled
+    os.replace(f"{base}.asm.tmp", f"{base}.asm")
+    return parse_asm(f"{base}.asm"), f"{base}.ssa_opt"
+
+
+def compile_function(func, name: str, workdir: str, steps: int = 1,
+                     optimizer: List[str] = OPTIMIZER) -> Tuple[Program, str]:
+    # func: an ir.Function, e.g. LIF(ValueType.FLOAT)
+    from ir import gen
+    return compile_ssa(gen(func, steps), name, workdir, optimizer)
@@ -0,0 +1,99 @@
+import sys
+from typing import Optional, Tuple
+
+import numpy as np
+
+from asm import parse_asm
+
+# assumed model of the device random number generator: assembly.txt only
+# defines the threshold exp(-lambda)*(2^16) of pois, not the generator, so
+# the xorshift32 below (one per lane, seeded from the neuron id, advanced
+# once per poisson instruction, upper 16 bits compared against the
+# threshold) is still to be checked against the device. A neuron fires with
+# probability 1-exp(-lambda), i.e. at least one event of a poisson process
+THRESHOLD_BITS = 16
+# cells (steps x neurons) of the event matrix spike_trains holds at once
+BLOCK = 1 << 20
+
+
+def new_rng(ids: np.ndarray, seed: int = 0) -> np.ndarray:
+    ids = np.asarray(ids, dtype=np.uint64)
+    state = (ids + np.uint64(1)) * np.uint64(0x9E3779B9) \
+        + np.uint64(seed) * np.uint64(0x85EBCA6B)
+    state = (state ^ (state >> np.uint64(32))).astype(np.uint32)
+    # xorshift must not start from zero
+    return np.where(state == 0, np.uint32(1), state).astype(np.uint32)
+
+
+def rng_next(rng: np.ndarray) -> np.ndarray:
+    rng ^= rng << np.uint32(13)
+    rng ^= rng >> np.uint32(17)
+    rng ^= rng << np.uint32(5)
+    return rng >> np.uint32(32 - THRESHOLD_BITS)
+
+
+def threshold(lam: np.ndarray) -> np.ndarray:
+    # per neuron Const of poisson_rate.py, truncated like ir.poisson_distribution
+    return (np.exp(-np.asarray(lam, dtype=np.float64)) * (2 ** THRESHOLD_BITS)).astype(np.int64)
+
+
+def spike_trains(thresholds: np.ndarray, steps: int, ids: Optional[np.ndarray] = None,
+                 seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    # (step, neuron) events of the rng model for the given thresholds
+    thresholds = np.asarray(thresholds, dtype=np.uint32)
+    if ids is None:
+        ids = np.arange(len(thresholds))
+    # neuron blocks, each advanced through the steps a chunk of rows at a time
+    width = min(max(len(thresholds), 1), BLOCK)
+    height = max(BLOCK // width, 1)
+    fired = np.empty((height, width), dtype=bool)
+    all_steps = [np.zeros(0, dtype=np.uint32)]
+    all_ids = [np.zeros(0, dtype=np.uint32)]
+    for start in range(0, len(thresholds), width):
+        stop = min(start + width, len(thresholds))
+        rng = new_rng(ids[start:stop], seed)
+        thr = thresholds[start:stop]
+        for first in range(0, steps, height):
+            rows = fired[:min(height, steps - first), :stop - start]
+            for row in rows:
+                np.greater_equal(rng_next(rng), thr, out=row)
+            step_idx, neuron = np.nonzero(rows)
+            all_steps.append((step_idx + first).astype(np.uint32))
+            all_ids.append((neuron + start).astype(np.uint32))
+    order_steps = np.concatenate(all_steps)
+    order_ids = np.concatenate(all_ids)
+    if len(thresholds) <= width:
+        # a single block is already ordered by step, then neuron
+        return order_steps, order_ids
+    order = np.lexsort((order_ids, order_steps))
+    return order_steps[order], order_ids[order]
+
+
+if __name__ == '__main__':
+    # python3 poisson.py poisson_rate.asm rates.npy steps
+    # checks the batched generator against the compiled program in the
+    # simulator; both use rng_next, so this covers the batching and the
+    # thresholds, not the rng model against the device
+    from memimage import build
+    from simulator import Kernel
+
+    program = parse_asm(sys.argv[1])
+    lam = np.load(sys.argv[2])
+    steps = int(sys.argv[3])
+    thresholds = threshold(lam)
+
+    expected = spike_trains(thresholds, steps)
+
+    state = build(program, len(lam), {'threshold': thresholds})
+    rng = new_rng(np.arange(len(lam)))
+    kernel = Kernel(program)
+    got_steps, got_ids = [], []
+    for step in range(steps):
+        kernel.run(state, rng)
+        spikes = np.flatnonzero(state['O_fire'])
+        got_steps.append(np.full(len(spikes), step, dtype=np.uint32))
+        got_ids.append(spikes.astype(np.uint32))
+    same = np.array_equal(expected[0], np.concatenate(got_steps)) \
+        and np.array_equal(expected[1], np.concatenate(got_ids))
+    print(f"Spikes: {len(expected[0])}, mean rate: {len(expected[0]) / steps / len(lam)}, "
+          f"matches simulated program: {same}")
@@ -0,0 +1,220 @@
+import sys
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from asm import Program, indexed_sites, mem_index, parse_asm
+from memimage import FIXED_SHIFT, build
+from poisson import new_rng, rng_next
+
+
+def _f(word):
+    return word.view(np.float32)
+
+
+def _s(word):
+    return word.view(np.int32)
+
+
+def _u(value):
+    return np.asarray(value).view(np.uint32)
+
+
+def _b(cond):
+    return np.asarray(cond, dtype=np.uint32)
+
+
+def _mul_x(a, b):
+    prod = (_s(a).astype(np.int64) * _s(b).astype(np.int64)) >> FIXED_SHIFT
+    return _u(prod.astype(np.int32))
+
+
+# exp_f as cephes expf in float32 arithmetic; cgen emits the same sequence
+# of operations from these constants, so both backends round alike (libm
+# expf and np.exp differ in the last ulp)
+EXP_LO = np.float32(-103.97)
+EXP_HI = np.float32(88.7228)
+EXP_LOG2E = np.float32(1.44269504088896341)
+EXP_C1 = np.float32(0.693359375)
+EXP_C2 = np.float32(-2.12194440e-4)
+EXP_POLY = [np.float32(c) for c in (1.9875691500e-4, 1.3981999507e-3, 8.3334519073e-3,
+                                    4.1665795894e-2, 1.6666665459e-1, 5.0000001201e-1)]
+
+
+def _pow2(e):
+    return ((e + 127).astype(np.uint32) << np.uint32(23)).view(np.float32)
+
+
+def _exp_f(a):
+    x = _f(a)
+    xc = np.where((x >= EXP_LO) & (x <= EXP_HI), x, np.float32(0))
+    # x = n * ln(2) + r, |r| <= ln(2) / 2
+    n = np.floor(xc * EXP_LOG2E + np.float32(0.5))
+    r = xc - n * EXP_C1 - n * EXP_C2
+    p = EXP_POLY[0]
+    for c in EXP_POLY[1:]:
+        p = p * r + c
+    y = p * r * r + r + np.float32(1)
+    # 2^n in two factors, n spans more than the normal exponents
+    e = np.asarray(n).astype(np.int32)
+    half = e >> np.int32(1)
+    y = y * _pow2(half) * _pow2(e - half)
+    y = np.where(x > EXP_HI, np.float32(np.inf), np.where(x < EXP_LO, np.float32(0), y))
+    return _u(np.where(np.isnan(x), x, y).astype(np.float32))
+
+
+# op -> semantics on 32 bit words, see assembly.txt
+OPS: Dict[str, Callable] = {
+    'lu_imm': lambda a: _u(np.asarray(a, dtype=np.uint32) << np.uint32(13)),
+    'ls_imm': lambda a: a,
+
+    'not_i': lambda a: ~a,
+    'gt_i_imm': lambda a, b: _b(_s(a) > _s(b)),
+    'sub_i_imm': lambda a, b: _u(_s(a) - _s(b)),
+    'or_i_imm': lambda a, b: a | b,
+    'move': lambda a: a,
+    'fire': lambda a: a,
+    'exp_f': _exp_f,
+
+    'and_i': lambda a, b: a & b,
+    'or_i': lambda a, b: a | b,
+    'sub_i': lambda a, b: _u(_s(a) - _s(b)),
+    'gt_i': lambda a, b: _b(_s(a) > _s(b)),
+    'mul_f': lambda a, b: _u(_f(a) * _f(b)),
+    'add_f': lambda a, b: _u(_f(a) + _f(b)),
+    'sub_f': lambda a, b: _u(_f(a) - _f(b)),
+    'ge_f': lambda a, b: _b(_f(a) >= _f(b)),
+    'div_f': lambda a, b: _u(_f(a) / _f(b)),
+    'le_f': lambda a, b: _b(_f(a) <= _f(b)),
+    'mul_x': _mul_x,
+    'add_x': lambda a, b: _u(_s(a) + _s(b)),
+    'sub_x': lambda a, b: _u(_s(a) - _s(b)),
+    'ge_x': lambda a, b: _b(_s(a) >= _s(b)),
+    'le_x': lambda a, b: _b(_s(a) <= _s(b)),
+
+    'muladd_f': lambda a, b, c: _u(_f(a) * _f(b) + _f(c)),
+    'mulsub_f': lambda a, b, c: _u(_f(a) * _f(b) - _f(c)),
+    'mux': lambda a, b, c: np.where(a != 0, b, c),
+}
+
+
+def literal_word(arg: str) -> np.ndarray:
+    try:
+        return np.array(int(arg) & 0xFFFFFFFF, dtype=np.uint32)
+    except ValueError:
+        return np.array(float(arg), dtype=np.float32).view(np.uint32)
+
+
+class Kernel:
+    # vectorized interpreter of one compiled program,
+    # every lane of the vector is one neuron
+    def __init__(self, program: Program) -> None:
+        if len(indexed_sites(program)) > 0:
+            # gathered through the index table, not one word per lane
+            raise Exception(f"indexed sites {indexed_sites(program)} of {program.name} "
+                            "are not supported")
+        self.program = program
+        self.insts = []
+        for inst in program.instructions:
+            operands = []
+            for arg in inst.args:
+                index = mem_index(arg)
+                if index is not None:
+                    operands.append(('mem', program.memories[index]))
+                elif arg.startswith('r'):
+                    operands.append(('reg', arg))
+                else:
+                    operands.append(('imm', literal_word(arg)))
+            if inst.op in ('pois_imm', 'pois'):
+                func = None
+            elif inst.op in OPS:
+                func = OPS[inst.op]
+            else:
+                raise Exception(f"unknown op {inst.op} in {program.name}")
+
+            index = mem_index(inst.dst)
+            if index is not None:
+                dst = ('mem', program.memories[index])
+            else:
+                dst = ('reg', inst.dst)
+            self.insts.append((inst.op, func, operands, dst))
+
+    def run(self, state: np.ndarray, rng: Optional[np.ndarray] = None) -> None:
+        regs = {}
+        with np.errstate(all='ignore'):
+            for op, func, operands, dst in self.insts:
+                args = []
+                for kind, value in operands:
+                    if kind == 'mem':
+                        args.append(state[value])
+                    elif kind == 'reg':
+                        args.append(regs[value])
+                    else:
+                        args.append(value)
+
+                if op in ('pois_imm', 'pois'):
+                    assert rng is not None, "poisson source needs a rng state"
+                    result = _b(rng_next(rng) >= args[0])
+                else:
+                    result = func(*args)
+
+                if dst[0] == 'mem':
+                    state[dst[1]] = result
+                else:
+                    # copy, mem views are overwritten in place
+                    regs[dst[1]] = np.array(result, dtype=np.uint32)
+
+
+def fire_sites(program: Program) -> List[str]:
+    # O_fire, or one O_fire_<step> per step of an unrolled program
+    if 'O_fire' in program.memories:
+        return ['O_fire']
+    sites = []
+    while f'O_fire_{len(sites)}' in program.memories:
+        sites.append(f'O_fire_{len(sites)}')
+    return sites
+
+
+def steps_per_run(program: Program, steps: int) -> int:
+    # time steps one run of the kernel advances, steps has to be a multiple
+    k = max(len(fire_sites(program)), 1)
+    if steps % k != 0:
+        raise Exception(f"{program.name} runs {k} steps at once, {steps} steps is not a multiple")
+    return k
+
+
+def kernel_runs(program: Program, steps: int) -> Iterator[List[Tuple[int, Optional[str]]]]:
+    # one entry per run of the kernel: (time step, fire site) for every
+    # step it advances, site None for programs without a fire output
+    sites: List[Optional[str]] = list(fire_sites(program)) or [None]
+    for step in range(0, steps, steps_per_run(program, steps)):
+        yield [(step + i, site) for i, site in enumerate(sites)]
+
+
+def fired(state: np.ndarray, site: str = 'O_fire') -> np.ndarray:
+    return np.flatnonzero(state[site])
+
+
+if __name__ == '__main__':
+    # python3 simulator.py model.asm neurons steps [site=value ...]
+    program = parse_asm(sys.argv[1])
+    size = int(sys.argv[2])
+    steps = int(sys.argv[3])
+    params = {}
+    for arg in sys.argv[4:]:
+        key, value = arg.split('=')
+        params[key] = float(value)
+
+    state = build(program, size, params)
+    rng = new_rng(np.arange(size))
+    kernel = Kernel(program)
+    counts = np.zeros(size, dtype=np.int64)
+    for outputs in kernel_runs(program, steps):
+        kernel.run(state, rng)
+        for step, site in outputs:
+            if site is None:
+                continue
+            spikes = fired(state, site)
+            counts[spikes] += 1
+            print(f"{step}: {len(spikes)} spikes")
+    print(f"Mean rate: {counts.mean() / steps}")
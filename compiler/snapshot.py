@@ -0,0 +1,315 @@
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from memimage import ArrayLike, update
+from partition import (Core, Network, Simulation, build_cores, build_graph, load_network,
+                       partition, population, synapses)
+
+# file layout:
+# header page: magic, version, step, number of regions, valid history slots,
+# checkpoint generation and its copy of the regions, followed by the region
+# index, see ENTRY
+# regions, page aligned, twice: per core the memory image in the compiled
+# layout, the rng lanes and optionally the synapse weights, then the recent
+# spikes as one bitmap over all neurons per delay slot
+MAGIC = b'GBSN'
+VERSION = 3
+PAGE = mmap.PAGESIZE
+PAGE_WORDS = PAGE // 4
+HEADER = struct.Struct('<4sIQIIQI')
+# name, byte offset of both copies, words
+ENTRY = struct.Struct('<32sQQQ')
+VARIABLE_PREFIXES = ('V_', 'VI_')
+# pages compared at once by dirty_pages
+CHUNK_PAGES = 1024
+
+
+def align(offset: int) -> int:
+    return (offset + PAGE - 1) // PAGE * PAGE
+
+
+def variable_pages(core: Core, network: Network) -> np.ndarray:
+    # pages holding V_ sites of the core, consts and literals never change
+    # after the first checkpoint; a record is at most 32 words, so every
+    # page between the first and the last V_ site of a segment holds some
+    pages = []
+    for seg in core.segments:
+        program = population(network, seg.population).program
+        sites = [index for index, site in enumerate(program.memories)
+                 if site.startswith(VARIABLE_PREFIXES)]
+        if len(sites) == 0 or seg.stop == seg.start:
+            continue
+        first = seg.base + sites[0]
+        last = seg.base + (seg.stop - seg.start - 1) * program.stride + sites[-1]
+        pages.append(np.arange(first // PAGE_WORDS, last // PAGE_WORDS + 1))
+    if len(pages) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.unique(np.concatenate(pages))
+
+
+def history_words(simulation: Simulation) -> np.ndarray:
+    total = sum(len(core.gids) for core in simulation.cores)
+    slots = np.zeros((simulation.history.maxlen, (total + 31) // 32 * 4), dtype=np.uint8)
+    for slot, spikes in enumerate(simulation.history):
+        bits = np.zeros(total, dtype=bool)
+        bits[spikes] = True
+        packed = np.packbits(bits, bitorder='little')
+        slots[slot, :len(packed)] = packed
+    return slots.view('<u4').reshape(-1)
+
+
+def state_regions(simulation: Simulation, weights: bool) -> Dict[str, np.ndarray]:
+    # region -> current words
+    regions = {}
+    for c, state in enumerate(simulation.states):
+        regions[f"memory{c}"] = state.memory
+        lanes = [rng for _, _, rng, _ in state.views]
+        regions[f"rng{c}"] = np.concatenate(lanes) if len(lanes) > 0 else np.zeros(0, dtype=np.uint32)
+        if weights:
+            regions[f"weight{c}"] = state.core.syn_weight
+    regions["history"] = history_words(simulation)
+    return regions
+
+
+def tracked_pages(simulation: Simulation) -> Dict[str, np.ndarray]:
+    # region -> pages that can change, regions not listed can change anywhere
+    return {f"memory{c}": variable_pages(state.core, simulation.network)
+            for c, state in enumerate(simulation.states)}
+
+
+def dirty_pages(words: np.ndarray, saved: np.ndarray,
+                tracked: Optional[np.ndarray] = None) -> np.ndarray:
+    # pages whose words differ from the saved ones, compared in contiguous
+    # chunks of whole pages; tracked: only these pages, None for all
+    total = (len(words) + PAGE_WORDS - 1) // PAGE_WORDS
+    spans = runs(tracked) if tracked is not None else [(0, total)]
+    dirty = [np.zeros(0, dtype=np.int64)]
+    for start, stop in spans:
+        for first in range(start, stop, CHUNK_PAGES):
+            lo = first * PAGE_WORDS
+            hi = min(min(first + CHUNK_PAGES, stop) * PAGE_WORDS, len(words))
+            differ = words[lo:hi] != saved[lo:hi]
+            full = (hi - lo) // PAGE_WORDS * PAGE_WORDS
+            dirty.append(np.flatnonzero(differ[:full].reshape(-1, PAGE_WORDS).any(axis=1)) + first)
+            if full < hi - lo and differ[full:].any():
+                dirty.append(np.array([first + full // PAGE_WORDS]))
+    return np.concatenate(dirty)
+
+
+def runs(pages: np.ndarray) -> List[Tuple[int, int]]:
+    # sorted page numbers -> [start, stop) ranges of consecutive pages
+    if len(pages) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(pages) != 1) + 1
+    starts = np.concatenate([[0], breaks])
+    stops = np.concatenate([breaks, [len(pages)]])
+    return [(int(pages[a]), int(pages[b - 1]) + 1) for a, b in zip(starts, stops)]
+
+
+class Snapshot:
+    # checkpoint of a simulation in a memory mapped file; the regions are
+    # kept twice and a checkpoint rewrites the copy not holding the last one,
+    # only the pages that differ from it, and then switches the header over,
+    # so a crash while writing leaves the last complete checkpoint in place
+    def __init__(self, path: str, access: int = mmap.ACCESS_WRITE) -> None:
+        self.file = open(path, 'rb' if access == mmap.ACCESS_COPY else 'r+b')
+        # ACCESS_COPY maps the file copy on write, for runs forked from it
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=access)
+        magic, version, self.steps, count, self.history_len, self.generation, self.active = \
+            HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception(f"{path} is not a snapshot")
+        # region -> pages that can change, computed by the first checkpoint
+        self.tracked: Optional[Dict[str, np.ndarray]] = None
+        self.offsets: List[Dict[str, int]] = [{}, {}]
+        self.copies: List[Dict[str, np.ndarray]] = [{}, {}]
+        for i in range(count):
+            name, *offsets, words = ENTRY.unpack_from(self.mmap, HEADER.size + i * ENTRY.size)
+            name = name.rstrip(b'\0').decode()
+            for copy, offset in enumerate(offsets):
+                self.offsets[copy][name] = offset
+                self.copies[copy][name] = np.frombuffer(self.mmap, dtype='<u4', count=words,
+                                                        offset=offset)
+
+    @property
+    def regions(self) -> Dict[str, np.ndarray]:
+        # the last complete checkpoint
+        return self.copies[self.active]
+
+    @staticmethod
+    def create(path: str, simulation: Simulation, weights: bool = False) -> 'Snapshot':
+        # weights: also keep the synapse weights, for plastic synapses
+        regions = state_regions(simulation, weights)
+        assert(HEADER.size + ENTRY.size * len(regions) <= PAGE)
+        offset = PAGE
+        offsets = []
+        for words in list(regions.values()) * 2:
+            offsets.append(offset)
+            offset = align(offset + len(words) * 4)
+        entries = [ENTRY.pack(name.encode(), offsets[i], offsets[i + len(regions)], len(words))
+                   for i, (name, words) in enumerate(regions.items())]
+        with open(path, 'wb') as f:
+            f.truncate(offset)
+            for start, words in zip(offsets, list(regions.values()) * 2):
+                f.seek(start)
+                f.write(np.asarray(words, dtype='<u4').tobytes())
+            # a valid header only once the regions are on disk
+            f.flush()
+            os.fsync(f.fileno())
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, simulation.steps, len(regions),
+                                len(simulation.history), 0, 0) + b''.join(entries))
+            f.flush()
+            os.fsync(f.fileno())
+        return Snapshot(path)
+
+    def checkpoint(self, simulation: Simulation) -> int:
+        # returns the number of pages written; the simulation has to have
+        # the cores of the first checkpoint
+        if self.tracked is None:
+            self.tracked = tracked_pages(simulation)
+        target = 1 - self.active
+        written = 0
+        for name, words in state_regions(simulation, "weight0" in self.regions).items():
+            saved = self.copies[target][name]
+            if len(saved) != len(words):
+                raise Exception(f"snapshot region {name} does not match the simulation")
+            # against the checkpoint before the last one, which this copy holds
+            pages = dirty_pages(words, saved, self.tracked.get(name))
+            for start, stop in runs(pages):
+                lo, hi = start * PAGE_WORDS, min(stop * PAGE_WORDS, len(words))
+                saved[lo:hi] = words[lo:hi]
+                self.mmap.flush(self.offsets[target][name] + lo * 4, (hi - lo) * 4)
+            written += len(pages)
+        # the copy is on disk, switch over with a single header write
+        self.steps = simulation.steps
+        self.history_len = len(simulation.history)
+        self.generation += 1
+        self.active = target
+        HEADER.pack_into(self.mmap, 0, MAGIC, VERSION, self.steps, len(self.regions),
+                         self.history_len, self.generation, self.active)
+        self.mmap.flush(0, PAGE)
+        return written
+
+    def pages(self) -> int:
+        return sum((len(words) + PAGE_WORDS - 1) // PAGE_WORDS for words in self.regions.values())
+
+    def restore(self, simulation: Simulation) -> None:
+        for c, state in enumerate(simulation.states):
+            saved = self.regions[f"memory{c}"]
+            if len(saved) != len(state.memory):
+                raise Exception(f"snapshot memory of core {c} does not match the simulation")
+            if not np.shares_memory(saved, state.memory):
+                np.copyto(state.memory, saved)
+            lanes = self.regions[f"rng{c}"]
+            for _, _, rng, first in state.views:
+                rng[...] = lanes[first:first + len(rng)]
+            if f"weight{c}" in self.regions:
+                # synapse tables are shared by simulations of the same cores
+                np.copyto(state.core.syn_weight, self.regions[f"weight{c}"])
+
+        total = sum(len(core.gids) for core in simulation.cores)
+        slots = self.regions["history"].view(np.uint8).reshape(simulation.history.maxlen, -1)
+        simulation.history.clear()
+        for slot in range(self.history_len):
+            bits = np.unpackbits(slots[slot], count=total, bitorder='little')
+            simulation.history.append(np.flatnonzero(bits))
+        simulation.steps = self.steps
+
+    def close(self) -> None:
+        self.copies = [{}, {}]
+        self.mmap.close()
+        self.file.close()
+
+
+def load(path: str, cores: List[Core], network: Network, seed: int = 0) -> Simulation:
+    # simulation continuing from the snapshot, the core memories are mapped
+    # copy on write from the file, so pages are only copied once written
+    snapshot = Snapshot(path, mmap.ACCESS_COPY)
+    memories = [snapshot.regions[f"memory{c}"] for c in range(len(cores))]
+    simulation = Simulation(cores, network, seed, memories)
+    snapshot.restore(simulation)
+    return simulation
+
+
+def apply(simulation: Simulation, variant: Dict[str, ArrayLike]) -> None:
+    # variant: 'population.site' -> scalar or one value per neuron
+    for key, value in variant.items():
+        name, site = key.split('.', 1)
+        program = population(simulation.network, name).program
+        value = np.asarray(value)
+        for state in simulation.states:
+            for seg, (_, view, _, _) in zip(state.core.segments, state.views):
+                if seg.population == name:
+                    update(view, program, site, value if value.ndim == 0 else value[seg.start:seg.stop])
+
+
+_forked: dict = {}
+
+
+def _init_fork(path: str, cores: List[Core], network: Network, steps: int, seed: int) -> None:
+    _forked.update(path=path, cores=cores, network=network, steps=steps, seed=seed)
+
+
+def _what_if(variant: Dict[str, ArrayLike]) -> List[np.ndarray]:
+    simulation = load(_forked['path'], _forked['cores'], _forked['network'], _forked['seed'])
+    apply(simulation, variant)
+    return [simulation.step() for _ in range(_forked['steps'])]
+
+
+def fork(path: str, cores: List[Core], network: Network, variants: List[Dict[str, ArrayLike]],
+         steps: int, seed: int = 0, processes: Optional[int] = None) -> List[List[np.ndarray]]:
+    # runs every variant from the same warmed up snapshot, one process each
+    with multiprocessing.Pool(processes, initializer=_init_fork,
+                              initargs=(path, cores, network, steps, seed)) as pool:
+        return pool.map(_what_if, variants)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="checkpoint, restore and fork a simulation")
+    parser.add_argument("network", help="network description in json")
+    parser.add_argument("snapshot", help="checkpoint file")
+    parser.add_argument("--cores", type=int, default=1)
+    parser.add_argument("--chunk", type=int, default=256, help="neurons per partitioning unit")
+    parser.add_argument("--steps", type=int, default=100, help="warm up steps")
+    parser.add_argument("--every", type=int, default=10, help="checkpoint period in steps")
+    parser.add_argument("--weights", action='store_true', help="checkpoint synapse weights")
+    parser.add_argument("--what-if", nargs='*', default=[], metavar='POP.SITE=VALUE',
+                        help="one forked run per argument")
+    parser.add_argument("--fork-steps", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    network = load_network(args.network)
+    syn = synapses(network)
+    graph, _ = build_graph(network, syn, args.chunk)
+    cores = build_cores(network, syn, graph, partition(graph, args.cores), args.cores)
+
+    simulation = Simulation(cores, network, args.seed)
+    snapshot = Snapshot.create(args.snapshot, simulation, args.weights)
+    for step in range(args.steps):
+        simulation.step()
+        if (step + 1) % args.every == 0 or step + 1 == args.steps:
+            written = snapshot.checkpoint(simulation)
+            print(f"Step {step + 1}: {written} of {snapshot.pages()} pages written")
+
+    # the restored run has to continue exactly like the original one
+    expected = [simulation.step() for _ in range(args.fork_steps)]
+    restored = load(args.snapshot, cores, network, args.seed)
+    result = [restored.step() for _ in range(args.fork_steps)]
+    same = all(np.array_equal(a, b) for a, b in zip(expected, result))
+    print(f"Restored at step {snapshot.steps}, matches uninterrupted run: {same}")
+
+    variants = []
+    for arg in args.what_if:
+        key, value = arg.split('=')
+        variants.append({key: float(value)})
+    for arg, spikes in zip(args.what_if, fork(args.snapshot, cores, network, variants,
+                                              args.fork_steps, args.seed)):
+        print(f"{arg}: {sum(len(s) for s in spikes)} spikes in {args.fork_steps} steps")
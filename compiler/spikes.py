@@ -0,0 +1,209 @@
+import asyncio
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import AsyncIterator, Iterator, Optional, Tuple
+
+import numpy as np
+
+from asm import parse_asm
+from memimage import build
+from poisson import new_rng
+from simulator import Kernel, kernel_runs
+
+# ring file layout:
+# header: magic, version, capacity and neurons, then head, tail and closed
+# which are updated in place by the producer (head, closed) and consumer (tail)
+# data: capacity bytes of records, positions grow forever and wrap modulo capacity
+MAGIC = b'GBSP'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQ')
+HEADER_SIZE = 64
+HEAD = 24
+TAIL = 32
+CLOSED = 40
+# record: step, format, number of spikes, payload bytes
+RECORD = struct.Struct('<IIII')
+
+FORMAT_INDEX = 0
+FORMAT_BITMAP = 1
+
+
+def compact(fire: np.ndarray, fmt: str = 'auto') -> Tuple[int, int, bytes]:
+    # dense fire output -> (format, spikes, payload)
+    spiking = np.asarray(fire) != 0
+    ids = np.flatnonzero(spiking)
+    # index list costs 4 bytes per spike, bitmap 1 bit per neuron
+    if fmt == 'bitmap' or (fmt == 'auto' and len(ids) * 32 > len(spiking)):
+        return FORMAT_BITMAP, len(ids), np.packbits(spiking, bitorder='little').tobytes()
+    return FORMAT_INDEX, len(ids), ids.astype('<u4').tobytes()
+
+
+def expand(fmt: int, payload: bytes, neurons: int) -> np.ndarray:
+    # payload -> sorted neuron ids
+    if fmt == FORMAT_BITMAP:
+        bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8),
+                             count=neurons, bitorder='little')
+        return np.flatnonzero(bits).astype(np.uint32)
+    return np.frombuffer(payload, dtype='<u4').copy()
+
+
+def padded(size: int) -> int:
+    return (size + 7) // 8 * 8
+
+
+class SpikeRing:
+    # single producer, single consumer ring buffer in a memory mapped file,
+    # the file stands in for the device memory the fire outputs are read from
+    def __init__(self, path: str) -> None:
+        self.file = open(path, 'r+b')
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+        magic, version, self.capacity, self.neurons = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception(f"{path} is not a spike ring")
+        self.head = np.frombuffer(self.mmap, dtype='<u8', count=1, offset=HEAD)
+        self.tail = np.frombuffer(self.mmap, dtype='<u8', count=1, offset=TAIL)
+        self.closed = np.frombuffer(self.mmap, dtype='<u8', count=1, offset=CLOSED)
+        self.data = np.frombuffer(self.mmap, dtype=np.uint8, count=self.capacity, offset=HEADER_SIZE)
+
+    @staticmethod
+    def create(path: str, capacity: int, neurons: int) -> 'SpikeRing':
+        capacity = padded(capacity)
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, capacity, neurons).ljust(HEADER_SIZE, b'\0'))
+            f.truncate(HEADER_SIZE + capacity)
+        return SpikeRing(path)
+
+    def used(self) -> int:
+        return int(self.head[0] - self.tail[0])
+
+    def free(self) -> int:
+        return self.capacity - self.used()
+
+    def _write(self, pos: int, data: bytes) -> None:
+        start = pos % self.capacity
+        first = min(len(data), self.capacity - start)
+        buf = np.frombuffer(data, dtype=np.uint8)
+        self.data[start:start + first] = buf[:first]
+        self.data[:len(data) - first] = buf[first:]
+
+    def _read(self, pos: int, size: int) -> bytes:
+        start = pos % self.capacity
+        first = min(size, self.capacity - start)
+        return self.data[start:start + first].tobytes() + self.data[:size - first].tobytes()
+
+    def put(self, step: int, fire: np.ndarray, fmt: str = 'auto',
+            timeout: Optional[float] = None, poll: float = 0.001) -> bool:
+        # compact and publish one step, waits while the consumer is behind;
+        # returns False if still full after timeout
+        kind, count, payload = compact(fire, fmt)
+        size = RECORD.size + padded(len(payload))
+        if size > self.capacity:
+            raise Exception(f"record of {size} bytes larger than ring")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.free() < size:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(poll)
+
+        pos = int(self.head[0])
+        self._write(pos, RECORD.pack(step, kind, count, len(payload)))
+        self._write(pos + RECORD.size, payload)
+        # publish after the payload is in place
+        self.head[0] = pos + size
+        return True
+
+    def get(self) -> Optional[Tuple[int, np.ndarray]]:
+        # next (step, neuron ids) or None if nothing is published yet
+        if self.used() == 0:
+            return None
+        pos = int(self.tail[0])
+        step, kind, _count, nbytes = RECORD.unpack(self._read(pos, RECORD.size))
+        ids = expand(kind, self._read(pos + RECORD.size, nbytes), self.neurons)
+        self.tail[0] = pos + RECORD.size + padded(nbytes)
+        return step, ids
+
+    def close(self) -> None:
+        # end of stream for the consumer
+        self.closed[0] = 1
+        self.mmap.flush()
+
+    def events(self, poll: float = 0.001) -> Iterator[Tuple[int, np.ndarray]]:
+        while True:
+            record = self.get()
+            if record is not None:
+                yield record
+            elif self.closed[0]:
+                # drain what was published before close
+                if self.used() == 0:
+                    return
+            else:
+                time.sleep(poll)
+
+    async def aevents(self, poll: float = 0.001) -> AsyncIterator[Tuple[int, np.ndarray]]:
+        while True:
+            record = self.get()
+            if record is not None:
+                yield record
+            elif self.closed[0] and self.used() == 0:
+                return
+            else:
+                await asyncio.sleep(poll)
+
+
+def trains(records: Iterator[Tuple[int, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    # (step, neuron) event arrays
+    steps, ids = [], []
+    for step, spikes in records:
+        steps.append(np.full(len(spikes), step, dtype=np.uint32))
+        ids.append(spikes)
+    if len(steps) == 0:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+    return np.concatenate(steps), np.concatenate(ids)
+
+
+if __name__ == '__main__':
+    # python3 spikes.py record model.asm neurons steps ring.bin [site=value ...]
+    # python3 spikes.py read ring.bin
+    if sys.argv[1] == 'record':
+        program = parse_asm(sys.argv[2])
+        size = int(sys.argv[3])
+        steps = int(sys.argv[4])
+        params = {}
+        for arg in sys.argv[6:]:
+            key, value = arg.split('=')
+            params[key] = float(value)
+        ring = None
+        if os.path.exists(sys.argv[5]):
+            ring = SpikeRing(sys.argv[5])
+            if ring.neurons != size:
+                raise Exception(f"{sys.argv[5]} is a ring of {ring.neurons} neurons, not {size}")
+            if ring.closed[0]:
+                # holds a finished recording, start a new one
+                ring = None
+            elif ring.head[0] != 0:
+                raise Exception(f"{sys.argv[5]} holds a recording in progress")
+            # else created beforehand, the consumer may already be attached
+        if ring is None:
+            ring = SpikeRing.create(sys.argv[5], 1 << 20, size)
+        state = build(program, size, params)
+        rng = new_rng(np.arange(size))
+        kernel = Kernel(program)
+        for outputs in kernel_runs(program, steps):
+            kernel.run(state, rng)
+            for step, site in outputs:
+                if site is not None:
+                    ring.put(step, state[site])
+        ring.close()
+    elif sys.argv[1] == 'read':
+        ring = SpikeRing(sys.argv[2])
+        total = 0
+        for step, spikes in ring.events():
+            total += len(spikes)
+            print(f"{step}: {len(spikes)} spikes")
+        print(f"Total spikes: {total}")
+    else:
+        raise Exception(f"unknown command {sys.argv[1]}")
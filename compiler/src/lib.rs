@@ -661,7 +661,7 @@ impl Program {
         }
 
         // lift at most 32-variables.len() literals
-        let avail = 32 - variables.len();
+        let avail = 32usize.saturating_sub(variables.len());
         if avail == 0 {
             // no more place
             return;
@@ -0,0 +1,172 @@
+import argparse
+import ctypes
+import itertools
+import json
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from asm import Instruction, Program, parse_asm, site_types
+from cgen import CKernel, parse_ssa
+from memimage import ArrayLike, build, layout_dtype, update
+from poisson import new_rng
+from simulator import Kernel, kernel_runs
+
+
+def grid(axes: Dict[str, Sequence[float]]) -> List[Dict[str, float]]:
+    # cartesian product of the swept values, last axis varies fastest
+    keys = list(axes)
+    return [dict(zip(keys, values)) for values in itertools.product(*[axes[key] for key in keys])]
+
+
+def build_batch(program: Program, size: int, variants: List[Dict[str, ArrayLike]],
+                params: Dict[str, ArrayLike] = {}) -> np.ndarray:
+    # (variants, neurons) records: the compiled layout with a batch axis in
+    # front, variant b is params overridden by variants[b]
+    types = site_types(program)
+    state = np.zeros((len(variants), size), dtype=layout_dtype(program))
+    build(program, size, params, out=state[0])
+    state[1:] = state[0]
+    for b, variant in enumerate(variants):
+        for key, value in variant.items():
+            update(state[b], program, key, value, types=types)
+    return state
+
+
+class FiringStats:
+    # streaming per variant reducer, memory does not grow with the steps
+    def __init__(self, variants: int, size: int) -> None:
+        self.variants = variants
+        self.size = size
+        self.steps = 0
+        self.counts = np.zeros((variants, size), dtype=np.int64)
+        self.last = np.full((variants, size), -1, dtype=np.int64)
+        # welford over the inter spike intervals of all neurons of a variant
+        self.isi_n = np.zeros(variants)
+        self.isi_mean = np.zeros(variants)
+        self.isi_m2 = np.zeros(variants)
+        # welford over the population spike count per step
+        self.pop_mean = np.zeros(variants)
+        self.pop_m2 = np.zeros(variants)
+
+    def update(self, fire: np.ndarray) -> None:
+        # fire: (variants, neurons) output of one step
+        fire = fire != 0
+        self.counts += fire
+
+        variant, neuron = np.nonzero(fire & (self.last >= 0))
+        isi = (self.steps - self.last[variant, neuron]).astype(np.float64)
+        n = np.bincount(variant, minlength=self.variants).astype(np.float64)
+        seen = n > 0
+        mean = np.bincount(variant, weights=isi, minlength=self.variants).astype(np.float64)
+        mean[seen] /= n[seen]
+        m2 = np.bincount(variant, weights=(isi - mean[variant]) ** 2,
+                         minlength=self.variants).astype(np.float64)
+        # merge the intervals of this step (chan et al.)
+        total = self.isi_n + n
+        delta = mean - self.isi_mean
+        self.isi_mean[seen] += delta[seen] * n[seen] / total[seen]
+        self.isi_m2[seen] += m2[seen] + delta[seen] ** 2 * self.isi_n[seen] * n[seen] / total[seen]
+        self.isi_n = total
+        self.last[fire] = self.steps
+
+        self.steps += 1
+        population = fire.sum(axis=1)
+        delta = population - self.pop_mean
+        self.pop_mean += delta / self.steps
+        self.pop_m2 += delta * (population - self.pop_mean)
+
+    def summary(self) -> Dict[str, np.ndarray]:
+        # one value per variant
+        rates = self.counts / max(self.steps, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            isi_std = np.sqrt(self.isi_m2 / np.maximum(self.isi_n - 1, 1))
+            pop_var = self.pop_m2 / max(self.steps - 1, 1)
+            return {
+                # spikes per neuron per step
+                'rate': rates.mean(axis=1),
+                'rate_std': rates.std(axis=1),
+                'active': (self.counts > 0).mean(axis=1),
+                'isi_mean': np.where(self.isi_n > 0, self.isi_mean, np.nan),
+                'isi_cv': np.where(self.isi_n > 1, isi_std / self.isi_mean, np.nan),
+                # of the population spike count, 1 for independent poisson neurons
+                'fano': np.where(self.pop_mean > 0, pop_var / self.pop_mean, np.nan),
+            }
+
+
+def sweep(program: Program, size: int, steps: int, variants: List[Dict[str, ArrayLike]],
+          params: Dict[str, ArrayLike] = {}, seed: int = 0,
+          insts: Optional[List[Instruction]] = None) -> FiringStats:
+    # all variants run in one pass over variants * neurons lanes;
+    # insts: optimized ssa to run through the C backend instead of the simulator
+    state = build_batch(program, size, variants, params)
+    # same random streams in every variant, so that they only differ by the parameters
+    rng = np.tile(new_rng(np.arange(size), seed), (len(variants), 1))
+    stats = FiringStats(len(variants), size)
+    # fire output of programs that have none
+    silent = np.zeros(state.shape, dtype=bool)
+    lanes = state.reshape(-1)
+
+    if insts is None:
+        kernel = Kernel(program)
+        for outputs in kernel_runs(program, steps):
+            kernel.run(lanes, rng.reshape(-1))
+            for _, site in outputs:
+                stats.update(state[site] if site is not None else silent)
+    else:
+        ckernel = CKernel(insts, program)
+        soa = ckernel.soa(lanes)
+        pointers = ckernel.pointers(soa)
+        for outputs in kernel_runs(program, steps):
+            ckernel.step_func(ctypes.c_size_t(len(lanes)), pointers,
+                              rng.ctypes.data_as(ctypes.c_void_p))
+            for _, site in outputs:
+                stats.update(soa[program.site(site)].reshape(state.shape) if site is not None
+                             else silent)
+    return stats
+
+
+def parse_values(value: str) -> List[float]:
+    # 1.5, 1,2,3 or lo:hi:count
+    if ':' in value:
+        lo, hi, count = value.split(':')
+        return list(np.linspace(float(lo), float(hi), int(count)))
+    return [float(v) for v in value.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="run a parameter sweep as one batch")
+    parser.add_argument("asm", help="compiled program, e.g. lif.asm")
+    parser.add_argument("neurons", type=int, help="neurons per variant")
+    parser.add_argument("steps", type=int)
+    parser.add_argument("params", nargs='*',
+                        help="site=value, swept with site=a,b,c or site=lo:hi:count")
+    parser.add_argument("--ssa", help="optimized ssa, runs the C backend")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the statistics here")
+    args = parser.parse_intermixed_args()
+
+    program = parse_asm(args.asm)
+    params, axes = {}, {}
+    for arg in args.params:
+        key, value = arg.split('=')
+        values = parse_values(value)
+        if len(values) == 1:
+            params[key] = values[0]
+        else:
+            axes[key] = values
+    variants = grid(axes)
+
+    stats = sweep(program, args.neurons, args.steps, variants, params, args.seed,
+                  None if args.ssa is None else parse_ssa(args.ssa))
+    summary = stats.summary()
+
+    columns = list(axes) + list(summary)
+    print("".join(f"{column:>12}" for column in columns))
+    for b, variant in enumerate(variants):
+        values = [variant[key] for key in axes] + [summary[key][b] for key in summary]
+        print("".join(f"{value:>12.4g}" for value in values))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump([dict(variant, **{key: float(summary[key][b]) for key in summary})
+                       for b, variant in enumerate(variants)], f, indent=2)
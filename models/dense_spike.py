@@ -0,0 +1,25 @@
+from ir import *
+
+
+class DenseSpike(Function):
+    def __init__(self, floatType: ValueType) -> None:
+        super().__init__()
+        self.floatType = floatType
+
+    def declare(self):
+        # Inputs
+        self.exc_in = Input("exc_in", self.floatType)
+        self.inh_in = Input("inh_in", self.floatType)
+
+        # Variables
+        self.exc = Variable("exc", self.floatType)
+        self.inh = Variable("inh", self.floatType)
+
+    def activate(self):
+        self.exc = self.exc + self.exc_in
+        self.inh = self.inh + self.inh_in
+
+
+if __name__ == '__main__':
+    dense_spike = DenseSpike(ValueType.FLOAT)
+    print(gen(dense_spike))
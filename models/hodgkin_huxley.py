@@ -8,11 +8,19 @@ def exp(val: Value, steps=3, use_exp=True):
     res = Literal(1.0, ValueType.FLOAT)
     for i in range(steps, 0, -1):
         res = res * val * Literal(1.0 / i, ValueType.FLOAT) + \
-            Literal(i, ValueType.FLOAT)
+            Literal(1.0, ValueType.FLOAT)
     return res
 
 
 class HodgkinHuxley(Function):
+    def __init__(self, use_exp: bool = True, exp_steps: int = 3) -> None:
+        super().__init__()
+        # exp_f instruction or a taylor series of exp_steps terms
+        self.use_exp = use_exp
+        self.exp_steps = exp_steps
+
+    def exp(self, val: Value) -> Value:
+        return exp(val, self.exp_steps, self.use_exp)
 
     def declare(self):
         # Variables
@@ -77,14 +85,14 @@ class HodgkinHuxley(Function):
         V = self.v - self.v_offset
 
         alpha_m = self.f0_32 * (self.f13 - V) / \
-            (exp((self.f13 - V) * self.f0_25) - self.f1)
+            (self.exp((self.f13 - V) * self.f0_25) - self.f1)
         beta_m = self.f0_28 * (V - self.f40) / \
-            (exp((V - self.f40) * self.f0_2) - self.f1)
+            (self.exp((V - self.f40) * self.f0_2) - self.f1)
         alpha_n = self.f0_032 * (self.f15 - V) / \
-            (exp((self.f15 - V) * self.f0_2) - self.f1)
-        beta_n = self.f0_5 * exp((self.f10 - V) / self.f40)
-        alpha_h = self.f0_128 * exp((self.f17 - V) / self.f18)
-        beta_h = self.f4 / (self.f1 + exp((self.f40 - V) * self.f0_2))
+            (self.exp((self.f15 - V) * self.f0_2) - self.f1)
+        beta_n = self.f0_5 * self.exp((self.f10 - V) / self.f40)
+        alpha_h = self.f0_128 * self.exp((self.f17 - V) / self.f18)
+        beta_h = self.f4 / (self.f1 + self.exp((self.f40 - V) * self.f0_2))
 
         self.m = self.m + (alpha_m - (alpha_m + beta_m) * self.m) * self.dt
         self.h = self.h + (alpha_h - (alpha_h + beta_h) * self.h) * self.dt
@@ -100,5 +108,6 @@ class HodgkinHuxley(Function):
         self.inh = Literal(0, ValueType.INTEGER)
 
 
-hh = HodgkinHuxley()
-print(gen(hh))
+if __name__ == '__main__':
+    hh = HodgkinHuxley()
+    print(gen(hh))
@@ -36,5 +36,6 @@ class IF(Function):
         self.inh = Literal(0, ValueType.INTEGER)
 
 
-if_model = IF()
-print(gen(if_model))
+if __name__ == '__main__':
+    if_model = IF()
+    print(gen(if_model))
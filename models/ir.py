@@ -72,6 +72,11 @@ class Value:
         return self.binary(other, f"{op}{self.ty.suffix()}", ValueType.INTEGER)
 
     def bin(self, other: Value, op: str) -> Value:
+        # x + 0 and x - 0, e.g. exc after it is cleared in an unrolled step
+        if op in ("add", "sub") and is_zero(other):
+            return self
+        if op == "add" and is_zero(self):
+            return other
         assert(self.ty == other.ty)
         return self.binary(other, f"{op}{self.ty.suffix()}", self.ty)
 
@@ -117,6 +122,44 @@ class Function:
     def activate(self):
         raise "You should override activate() in subclass"
 
+
+def declared(func: Function) -> dict:
+    # attribute -> named value declared by func
+    return {attr: value for attr, value in func.__dict__.items()
+            if isinstance(value, Value) and value.kind != ValueKind.LITERAL
+            and value.index in global_state.name_mapping}
+
+
+class Fused(Function):
+    # run several functions in one loop, values shared by name are forwarded
+    # in registers instead of being written back and read again
+    def __init__(self, *funcs: Function) -> None:
+        super().__init__()
+        self.funcs = funcs
+
+    def declare(self):
+        shapes = set()
+        self.names = []
+        for func in self.funcs:
+            func.declare()
+            values = declared(func)
+            # strided loops run per neuron, indexed loops per synapse
+            shapes.add(frozenset(value.access for value in values.values()))
+            self.names.append(list(values.keys()))
+            for name, value in values.items():
+                self.__dict__[name] = value
+        if len(shapes) > 1:
+            raise Exception("Cannot fuse functions with different loop shapes")
+
+    def activate(self):
+        for func, names in zip(self.funcs, self.names):
+            for name in names:
+                # forward latest value from previous functions
+                func.__dict__[name] = self.__dict__[name]
+            func.activate()
+            for name in names:
+                self.__dict__[name] = func.__dict__[name]
+
 # utility functions
 
 
@@ -125,6 +168,12 @@ def new_index() -> int:
     return global_state.counter - 1
 
 
+def is_zero(value: Value) -> bool:
+    # zero has the same bits in every value type
+    return value.kind == ValueKind.LITERAL \
+        and float(global_state.name_mapping[value.index]) == 0
+
+
 def get_name(value: Value) -> str:
     if value.access == AccessPattern.INDEXED:
         access = "I"
@@ -147,12 +196,31 @@ def get_name(value: Value) -> str:
         return f"T_{value.index}"
 
 
-def gen(func: Function) -> str:
+def gen(func: Function, steps: int = 1) -> str:
+    # with steps > 1, activate() is unrolled and variables stay in registers
+    # between steps, inputs and outputs get one slot per step: I_x_0, O_fire_0, ...
     global global_state
     global_state = GlobalState()
 
     func.declare()
-    func.activate()
+    values = declared(func)
+
+    # (output or variable, value written to it)
+    updates = []
+    for step in range(steps):
+        if steps > 1:
+            for name, value in values.items():
+                if value.kind == ValueKind.INPUT:
+                    func.__dict__[name] = Input(
+                        f"{name}_{step}", value.ty, value.access)
+
+        func.activate()
+
+        if steps > 1:
+            for name, value in values.items():
+                if value.kind == ValueKind.OUTPUT:
+                    output = Output(f"{name}_{step}", value.ty, value.access)
+                    updates.append((output, func.__dict__[name]))
 
     result = []
     temps = []
@@ -163,19 +231,21 @@ def gen(func: Function) -> str:
             result.append(
                 f"{get_name(val)} = {val.op}({', '.join([get_name(arg) for arg in val.args])})")
             temps.append(i)
-        elif val.kind == ValueKind.OUTPUT or val.kind == ValueKind.VARIABLE:
+        elif val.kind == ValueKind.VARIABLE or (val.kind == ValueKind.OUTPUT and steps == 1):
             update_values.append(val)
 
-    # find updated output and variable
     for value in update_values:
-        val = func.__dict__[global_state.name_mapping[value.index]]
+        updates.append(
+            (value, func.__dict__[global_state.name_mapping[value.index]]))
 
+    # find updated output and variable
+    for value, val in updates:
         found = False
         # insert right after assignment
         for i in range(len(result)):
             if result[i].split('=')[0].strip() == get_name(val):
                 # insert fire instruction after write to fire
-                if get_name(value) == 'O_fire':
+                if get_name(value).startswith('O_fire'):
                     result.insert(
                         i+1, f"{get_name(value)} = fire({get_name(val)})")
                 else:
@@ -193,6 +263,16 @@ def gen(func: Function) -> str:
 
 
 def named(name: str, kind: ValueKind, ty: ValueType, access: AccessPattern) -> Value:
+    # share the same memory site when declared again, e.g. by fused functions;
+    # V_exc and VI_exc are different sites, so the access pattern has to match
+    if kind != ValueKind.LITERAL:
+        for index, other in global_state.name_mapping.items():
+            ret = global_state.all_values[index]
+            if other == name and ret.kind == kind and ret.access == access:
+                if ret.ty != ty:
+                    raise Exception(f"{name} declared as {ret.ty} and {ty}")
+                return ret
+
     ret = Value(new_index(), kind, ty, "nop", [], access)
     global_state.name_mapping[ret.index] = name
     global_state.all_values[ret.index] = ret
@@ -246,3 +326,10 @@ def poisson_distribution(lam: float) -> Value:
     imm = math.exp(-lam) * (2 ** 16)
     return Value(new_index(),
                  ValueKind.TEMPORARY, ValueType.INTEGER, "pois_imm", [Literal(imm, ValueType.INTEGER)])
+
+
+def poisson(threshold: Value) -> Value:
+    # like poisson_distribution, with exp(-lambda)*(2^16) read per neuron
+    assert(threshold.ty == ValueType.INTEGER)
+    return Value(new_index(),
+                 ValueKind.TEMPORARY, ValueType.INTEGER, "pois", [threshold])
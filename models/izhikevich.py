@@ -2,9 +2,11 @@ from ir import *
 
 
 class Izhikevich(Function):
-    def __init__(self, floatType: ValueType) -> None:
+    def __init__(self, floatType: ValueType, substeps: int = 2) -> None:
         super().__init__()
         self.floatType = floatType
+        # v is integrated in substeps of dt / substeps
+        self.substeps = substeps
 
     def declare(self):
         # Variables
@@ -20,7 +22,7 @@ class Izhikevich(Function):
         self.d = Const("d", self.floatType)
         self.v_thresh = Const("v_thresh", self.floatType)
         self.dt = Const("dt", self.floatType)
-        self.f0_5 = Literal(0.5, self.floatType)
+        self.f_sub = Literal(1.0 / self.substeps, self.floatType)
         self.f0_04 = Literal(0.04, self.floatType)
         self.f5_0 = Literal(5.0, self.floatType)
         self.f125_0 = Literal(125.0, self.floatType)
@@ -31,10 +33,9 @@ class Izhikevich(Function):
 
     def activate(self):
         self.v = self.v + self.exc - self.inh
-        self.v = self.v + self.f0_5 * self.dt * \
-            (self.v * self.f0_04 * (self.v + self.f125_0) + (self.f140_0 - self.u))
-        self.v = self.v + self.f0_5 * self.dt * \
-            (self.v * self.f0_04 * (self.v + self.f125_0) + (self.f140_0 - self.u))
+        for _ in range(self.substeps):
+            self.v = self.v + self.f_sub * self.dt * \
+                (self.v * self.f0_04 * (self.v + self.f125_0) + (self.f140_0 - self.u))
         self.u = self.u + self.a * (self.b * self.v - self.u) * self.dt
 
         self.fire = (self.v >= self.v_thresh)
@@ -43,5 +43,6 @@ class IzhikevichEuler(Function):
         self.inh = Literal(0, ValueType.INTEGER)
 
 
-izhikevich_euler = IzhikevichEuler()
-print(gen(izhikevich_euler))
+if __name__ == '__main__':
+    izhikevich_euler = IzhikevichEuler()
+    print(gen(izhikevich_euler))
@@ -0,0 +1,8 @@
+from ir import *
+from lif import *
+from dense_spike import *
+
+if __name__ == '__main__':
+    # accumulate input, update and clear exc/inh in a single pass
+    lif_dense = Fused(DenseSpike(ValueType.FLOAT), LIF(ValueType.FLOAT))
+    print(gen(lif_dense))
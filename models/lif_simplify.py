@@ -45,5 +45,6 @@ class LIF(Function):
         self.inh = Literal(0, ValueType.INTEGER)
 
 
-lif = LIF()
-print(gen(lif))
+if __name__ == '__main__':
+    lif = LIF()
+    print(gen(lif))
@@ -0,0 +1,8 @@
+from ir import *
+from lif import *
+from dense_spike import *
+
+if __name__ == '__main__':
+    # four steps per program, one input and fire slot per step: I_exc_in_<k>, O_fire_<k>
+    lif_unroll = Fused(DenseSpike(ValueType.FLOAT), LIF(ValueType.FLOAT))
+    print(gen(lif_unroll, steps=4))
@@ -0,0 +1,19 @@
+from ir import *
+
+
+class PoissonRate(Function):
+    def declare(self):
+        # Constants
+        # exp(-lambda)*(2^16) of each neuron
+        self.threshold = Const("threshold", ValueType.INTEGER)
+
+        # Outputs
+        self.fire = Output("fire", ValueType.INTEGER)
+
+    def activate(self):
+        self.fire = poisson(self.threshold)
+
+
+if __name__ == '__main__':
+    poisson_rate = PoissonRate()
+    print(gen(poisson_rate))